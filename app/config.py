@@ -0,0 +1,48 @@
+import os
+from typing import List
+from pydantic import BaseModel, Field, field_validator
+
+# JWTs are signed with a shared secret
+SUPPORTED_ALGORITHMS = ("HS256", "HS384", "HS512")
+
+# Settings field -> environment variable
+_ENV = {
+    "db_uri": "DB_URI",
+    "db_name": "DB_NAME",
+    "secret_key": "SECRET_KEY",
+    "algorithm": "ALGORITHM",
+    "access_token_expire_minutes": "ACCESS_TOKEN_EXPIRE_MINUTES",
+    "cors_origins": "CORS_ORIGINS",
+}
+
+
+class Settings(BaseModel):
+    """Process-wide settings, validated once when the app is created.
+
+    Tuning knobs (pool sizes, cache TTLs, ...) stay in their own modules'
+    environment variables; these are the ones the app can not start without.
+    """
+
+    # unset DB_URI keeps the driver default (a local mongod)
+    db_uri: str = Field("mongodb://localhost:27017", min_length=1)
+    db_name: str = "hospital"
+    secret_key: str = Field(min_length=1)
+    algorithm: str = "HS256"
+    access_token_expire_minutes: int = Field(30, gt=0)
+    cors_origins: List[str] = ["*"]
+
+    @field_validator("algorithm")
+    @classmethod
+    def _supported_algorithm(cls, algorithm: str) -> str:
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"ALGORITHM must be one of {', '.join(SUPPORTED_ALGORITHMS)}")
+        return algorithm
+
+    @classmethod
+    def from_env(cls, environ=None) -> "Settings":
+        """Build from ``environ`` (default ``os.environ``); unset variables keep their defaults."""
+        environ = os.environ if environ is None else environ
+        values = {field: environ[name] for field, name in _ENV.items() if environ.get(name)}
+        if "cors_origins" in values:
+            values["cors_origins"] = [origin.strip() for origin in values["cors_origins"].split(",") if origin.strip()]
+        return cls(**values)
@@ -1,8 +1,116 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 import os
+import threading
 
-try:
-    client = AsyncIOMotorClient(os.getenv("DB_URI"))
-    db = client["hospital"]
-except Exception as e:
-    print(f"❌ Error connecting: {e}")
\ No newline at end of file
+# Pool and timeout options, read from the environment (unset -> driver default)
+_CLIENT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+}
+
+
+def client_options() -> dict:
+    return {option: int(os.environ[env]) for option, env in _CLIENT_OPTIONS.items() if os.getenv(env)}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection counts across the client's pools, fed by driver (CMAP) events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.check_out_failures = 0
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_checked_out(self, event):
+        self._add("in_use", 1)
+
+    def connection_checked_in(self, event):
+        self._add("in_use", -1)
+
+    def connection_check_out_failed(self, event):
+        self._add("check_out_failures", 1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"open": self.open, "in_use": self.in_use, "check_out_failures": self.check_out_failures}
+
+
+class _Database:
+    """Module-level handle to the application database (``DB_NAME``, default ``hospital``).
+
+    Routes import it once (``from db import db``); the Motor client behind it is
+    created by ``connect()`` in the app lifespan, i.e. per worker after fork.
+    """
+
+    def __init__(self):
+        self._database = None
+
+    def _get(self):
+        if self._database is None:
+            raise RuntimeError("Database is not connected; call db.connect() first")
+        return self._database
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, name):
+        return self._get()[name]
+
+
+client = None
+db = _Database()
+pool_stats = PoolStats()
+# driver event listeners attached to the client when it is created
+event_listeners = [pool_stats]
+
+
+def connect(uri: str = None, name: str = None):
+    """Create this process's client; ``uri``/``name`` default to ``DB_URI``/``DB_NAME``."""
+    global client
+    if client is None:
+        client = AsyncIOMotorClient(uri or os.getenv("DB_URI"), event_listeners=event_listeners, **client_options())
+        db._database = client[name or os.getenv("DB_NAME", "hospital")]
+    return db
+
+
+def close():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+        db._database = None
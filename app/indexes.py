@@ -0,0 +1,188 @@
+"""Index declarations for every collection the routes query.
+
+Ensured from the app lifespan, or once from the command line (before deploying):
+
+    python indexes.py               # flag old appointments active, list duplicate bookings, create missing indexes, report drift
+    python indexes.py --check       # only report drift (exit code 1 if any, or if a required index is missing)
+    python indexes.py --duplicates  # only list active appointments the unique slot indexes would reject (exit code 1 if any)
+"""
+import asyncio
+import sys
+from dotenv import load_dotenv
+load_dotenv()
+from pymongo import IndexModel
+import db as database
+from db import db
+from utils.slot import SLOT_INDEXES, mark_active_appointments
+from utils.occupancy import OCCUPYING_STATUSES
+from utils.counters import COUNTER_INDEXES
+from utils.archive import ARCHIVE_COLLECTION, ARCHIVE_INDEXES
+from utils.daily_stats import STATS_COLLECTION, STATS_INDEXES
+
+# doctor/staff emails are optional, so only documents that have one are unique
+_OPTIONAL_EMAIL = {"email": {"$type": "string"}}
+
+INDEXES = {
+    "patient": [
+        IndexModel([("email", 1)], name="email_unique", unique=True),
+    ],
+    "doctor": [
+        IndexModel([("email", 1)], name="email_unique", unique=True, partialFilterExpression=_OPTIONAL_EMAIL),
+    ],
+    "staff": [
+        IndexModel([("email", 1)], name="email_unique", unique=True, partialFilterExpression=_OPTIONAL_EMAIL),
+    ],
+    "appointment": SLOT_INDEXES + [
+        # doctor listings (keyset order) and, walked backwards, a doctor's last appointment
+        IndexModel([("doctor_id", 1), ("date", 1), ("time", 1), ("_id", 1)], name="doctor_schedule"),
+        # patient listings
+        IndexModel([("patient_id", 1), ("date", 1), ("time", 1), ("_id", 1)], name="patient_history"),
+        # staff listing of every appointment
+        IndexModel([("date", 1), ("time", 1), ("_id", 1)], name="schedule"),
+    ],
+    "appointment_counter": COUNTER_INDEXES,
+    # finished appointments moved out of the hot collection (history listings)
+    ARCHIVE_COLLECTION: ARCHIVE_INDEXES,
+    STATS_COLLECTION: STATS_INDEXES,
+}
+
+# indexes booking correctness depends on: the app does not start without them
+REQUIRED_INDEXES = {"appointment": [model.document["name"] for model in SLOT_INDEXES]}
+
+# index options that make two indexes with the same name different
+_COMPARED_OPTIONS = ("unique", "partialFilterExpression", "expireAfterSeconds", "sparse")
+
+
+async def ensure_indexes() -> list:
+    """Create every declared index; returns the ones that failed as ``"collection.name"``.
+
+    Indexes are created one at a time, so a failing one does not hold back the
+    rest; an existing index whose declaration changed is dropped and rebuilt.
+    """
+    failed = []
+    for collection, models in INDEXES.items():
+        try:
+            existing = await db[collection].index_information()
+        except Exception as e:
+            print(f"❌ Error reading indexes of {collection}: {e}")
+            existing = {}
+        for model in models:
+            name = model.document["name"]
+            try:
+                if name in existing and _normalize(model.document) != _normalize(existing[name]):
+                    print(f"🔁 Rebuilding index {collection}.{name}")
+                    await db[collection].drop_index(name)
+                await db[collection].create_indexes([model])
+            except Exception as e:
+                print(f"❌ Error creating index {collection}.{name}: {e}")
+                failed.append(f"{collection}.{name}")
+    return failed
+
+
+async def missing_required_indexes() -> list:
+    """Required indexes absent from the database, as ``"collection.name"``."""
+    missing = []
+    for collection, names in REQUIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        missing += [f"{collection}.{name}" for name in names if name not in existing]
+    return missing
+
+
+def _normalize(spec: dict) -> dict:
+    # declared keys are a SON mapping, index_information() returns (field, direction) pairs
+    key = spec["key"].items() if isinstance(spec["key"], dict) else spec["key"]
+    normalized = {"key": [(field, int(direction)) for field, direction in key]}
+    for option in _COMPARED_OPTIONS:
+        if option in spec:
+            normalized[option] = spec[option]
+    return normalized
+
+
+async def index_drift() -> dict:
+    """Compare declared indexes with the database.
+
+    Returns ``{collection: {"missing": [...], "changed": [...], "extra": [...]}}``
+    for the collections that differ; an empty dict means no drift.
+    """
+    drift = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        declared = {m.document["name"]: m.document for m in models}
+
+        missing = [name for name in declared if name not in existing]
+        changed = [name for name in declared
+                   if name in existing and _normalize(declared[name]) != _normalize(existing[name])]
+        extra = [name for name in existing if name not in declared and name != "_id_"]
+
+        if missing or changed or extra:
+            drift[collection] = {"missing": missing, "changed": changed, "extra": extra}
+    return drift
+
+
+# groups of active appointments that break a unique slot index: name -> grouped fields
+_DUPLICATE_KEYS = {
+    "doctor_slot_unique": ("doctor_id", "date", "time"),
+    "patient_day_unique": ("patient_id", "date"),
+}
+
+
+async def duplicate_bookings() -> dict:
+    """Active appointments sharing a doctor slot or a patient day.
+
+    Returns ``{index name: [{<grouped fields>, "count": n, "ids": [...]}, ...]}``
+    for the unique slot indexes that cannot be built until they are resolved
+    (cancel all but one appointment of each group).
+    """
+    duplicates = {}
+    for name, fields in _DUPLICATE_KEYS.items():
+        pipeline = [
+            {"$match": {"status": {"$in": list(OCCUPYING_STATUSES)}}},
+            {"$group": {"_id": {field: f"${field}" for field in fields},
+                        "count": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$sort": {f"_id.{field}": 1 for field in fields}},
+        ]
+        groups = await db.appointment.aggregate(pipeline).to_list(length=None)
+        if groups:
+            duplicates[name] = [{**group["_id"], "count": group["count"], "ids": group["ids"]} for group in groups]
+    return duplicates
+
+
+async def _report_duplicates() -> bool:
+    duplicates = await duplicate_bookings()
+    for name, groups in duplicates.items():
+        print(f"❌ {len(groups)} groups of active appointments break {name}:")
+        for group in groups:
+            ids = ", ".join(str(i) for i in group["ids"])
+            key = ", ".join(f"{field}={group[field]}" for field in _DUPLICATE_KEYS[name])
+            print(f"   {key}: {group['count']} appointments ({ids})")
+    return bool(duplicates)
+
+
+async def _main(check_only: bool, duplicates_only: bool) -> int:
+    database.connect()
+    if duplicates_only:
+        if not await _report_duplicates():
+            print("✅ No duplicate bookings")
+            return 0
+        return 1
+    if not check_only:
+        # appointments booked before the active flag existed must carry it before the unique indexes cover them
+        marked = await mark_active_appointments()
+        if marked:
+            print(f"✅ Marked {marked} existing appointments active")
+        await _report_duplicates()
+        await ensure_indexes()
+    drift = await index_drift()
+    for collection, report in drift.items():
+        print(f"{collection}: {report}")
+    missing = await missing_required_indexes()
+    if missing:
+        print(f"❌ Required indexes missing: {', '.join(missing)}")
+    if not drift:
+        print("✅ Indexes up to date")
+    return 1 if drift or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main("--check" in sys.argv[1:], "--duplicates" in sys.argv[1:])))
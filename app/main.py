@@ -1,28 +1,138 @@
+from time import perf_counter
+_IMPORT_STARTED = perf_counter()
+import os
 from fastapi import FastAPI
-from routes import staff,doctor,patient,appointment,profile
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 load_dotenv()
+import db as database
+from config import Settings
 
-app = FastAPI(title="Hospital Management System")
 
-from fastapi.middleware.cors import CORSMiddleware
+def create_app(settings: Settings = None) -> FastAPI:
+    """Build the application; ``settings`` default to ``Settings.from_env()``.
 
-app.add_middleware(
-  CORSMiddleware,
-#   allow_origins=["http://localhost:5500","http://127.0.0.1:5500","http://localhost:3000"], # or ["*"] for quick test
-  allow_origins=["*"], # or ["*"] for quick test
-  allow_credentials=True,
-  allow_methods=["*"],
-  allow_headers=["*"],
-)
+    Run with ``uvicorn main:create_app --factory`` (``uvicorn main:app`` still
+    works). Everything a worker owns (database client, background tasks) is
+    set up in the lifespan, i.e. after fork.
+    """
+    build_started = perf_counter()
+    settings = settings or Settings.from_env()
 
+    from routes import staff,doctor,patient,appointment,profile,health,queue,reports
+    from indexes import ensure_indexes, index_drift, missing_required_indexes
+    from utils.utility import load_jwt_settings, token_cache_stats
+    from routes.doctor import directory_cache_stats
+    from utils.slot import availability_cache
+    from utils.booking_queue import booking_queue
+    from utils.events import broker
+    from utils.login_throttle import login_throttle
+    from utils.archive import start_archiver, stop_archiver
+    from utils.metrics import track_request, command_metrics, render_prometheus
+    from utils.profiler import PROFILE_ENABLED, RequestProfiler, slow_query_profiler, start_profiler, stop_profiler
 
-app.include_router(patient.router, tags=["Patients"])
-app.include_router(doctor.router, tags=["Doctors"])
-app.include_router(staff.router, tags=["Staff"])
-app.include_router(profile.router, tags=["Profile"])
-app.include_router(appointment.router, tags=["Appointment"])
+    for listener in [command_metrics] + ([slow_query_profiler] if PROFILE_ENABLED else []):
+        if listener not in database.event_listeners:
+            database.event_listeners.append(listener)
 
-@app.get("/",)
-def home():
-    return {"message": "Hospital API Running"}
\ No newline at end of file
+    # seconds spent in each startup phase; "total" runs from importing main to serving
+    startup = {"imports": build_started - _IMPORT_STARTED}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        lifespan_started = perf_counter()
+        load_jwt_settings(settings)
+        database.connect(settings.db_uri, settings.db_name)
+        await ensure_indexes()
+        # without the unique slot indexes nothing stops double bookings: refuse to serve
+        missing = await missing_required_indexes()
+        if missing:
+            database.close()
+            raise RuntimeError(f"Required indexes missing: {', '.join(missing)} "
+                               f"(run python indexes.py from app/; --duplicates lists the bookings blocking them)")
+        try:
+            drift = await index_drift()
+            if drift:
+                print(f"⚠️ Index drift: {drift}")
+        except Exception as e:
+            print(f"❌ Error checking indexes: {e}")
+        start_profiler()
+        start_archiver()
+        ready = perf_counter()
+        startup["lifespan"] = ready - lifespan_started
+        startup["total"] = ready - _IMPORT_STARTED
+        print(f"🚀 Worker {os.getpid()} ready in {startup['total'] * 1000:.0f} ms "
+              f"(imports {startup['imports'] * 1000:.0f}, app {startup['build'] * 1000:.0f}, "
+              f"lifespan {startup['lifespan'] * 1000:.0f})")
+        yield
+        await stop_archiver()
+        stop_profiler()
+        database.close()
+
+
+    app = FastAPI(title="Hospital Management System", lifespan=lifespan)
+    app.state.settings = settings
+
+    from fastapi.middleware.cors import CORSMiddleware
+
+    app.add_middleware(
+      CORSMiddleware,
+    #   allow_origins=["http://localhost:5500","http://127.0.0.1:5500","http://localhost:3000"], # or ["*"] for quick test
+      allow_origins=settings.cors_origins, # CORS_ORIGINS, comma separated; default ["*"]
+      allow_credentials=True,
+      allow_methods=["*"],
+      allow_headers=["*"],
+    )
+    app.add_middleware(RequestProfiler)
+    app.middleware("http")(track_request)
+
+
+    app.include_router(patient.router, tags=["Patients"])
+    app.include_router(doctor.router, tags=["Doctors"])
+    app.include_router(staff.router, tags=["Staff"])
+    app.include_router(profile.router, tags=["Profile"])
+    app.include_router(appointment.router, tags=["Appointment"])
+    app.include_router(queue.router, tags=["Queue"])
+    app.include_router(reports.router, tags=["Reports"])
+    app.include_router(health.router, tags=["Health"])
+
+    @app.get("/",)
+    def home():
+        return {"message": "Hospital API Running"}
+
+
+    @app.get("/stats/")
+    def stats():
+        return {"token_cache": token_cache_stats(), "doctor_directory": directory_cache_stats(),
+                "availability": availability_cache.stats(), "booking_queue": booking_queue.stats(),
+                "events": broker.stats(), "login_throttle": login_throttle.stats(),
+                "startup_seconds": {phase: round(s, 4) for phase, s in startup.items()}}
+
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        pool = database.pool_stats.snapshot()
+        tokens = token_cache_stats()
+        gauges = {
+            "mongo_pool_connections_open": pool["open"],
+            "mongo_pool_connections_in_use": pool["in_use"],
+            "token_cache_hits": tokens["hits"],
+            "token_cache_misses": tokens["misses"],
+            "login_checks_in_flight": login_throttle.in_flight,
+            **{f"login_throttle_rejected_{reason}": n for reason, n in login_throttle.rejected.items()},
+            **{f"app_startup_{phase}_seconds": s for phase, s in startup.items()},
+        }
+        return PlainTextResponse(render_prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+    startup["build"] = perf_counter() - build_started
+    return app
+
+
+def __getattr__(name):
+    # ``main:app`` builds the app on first access, so importing main stays cheap
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
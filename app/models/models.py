@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, List
 from pydantic import EmailStr
 from pydantic import BaseModel,Field
 from typing_extensions import Annotated
@@ -40,3 +40,24 @@ class Appointment(BaseModel):
     doctor_id :str
     reason:str
 
+class BulkAppointmentItem(BaseModel):
+    patient_id :str
+    doctor_id :str
+    reason:str
+
+class BulkAppointment(BaseModel):
+    appointments: Annotated[List[BulkAppointmentItem],Field(min_length=1,max_length=500)]
+
+class ScheduleSession(BaseModel):
+    name: Annotated[str,Field(min_length=1,max_length=30)]
+    start: Annotated[str,Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$")]
+    end: Annotated[str,Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$|^24:00$")]
+
+class DoctorSchedule(BaseModel):
+    slot_minutes: Annotated[int,Field(ge=5,le=240)] = 20
+    # Monday first
+    weekly: Annotated[List[List[ScheduleSession]],Field(min_length=7,max_length=7)]
+
+class ScheduleException(BaseModel):
+    # an empty list is a day off
+    sessions: List[ScheduleSession] = []
@@ -1,20 +1,46 @@
-from fastapi import APIRouter,Depends,HTTPException
-from models.models import Appointment
+from fastapi import APIRouter,Depends,HTTPException,Query
+from fastapi.responses import StreamingResponse
+from models.models import Appointment, BulkAppointment
 from bson import ObjectId
-from utils.utility import get_current_user
-from datetime import datetime
-from utils.slot import book_slot
+from pymongo.errors import BulkWriteError
+from typing import Optional
+from utils.utility import get_current_principal,load_principal
+from datetime import datetime, date
+import asyncio
+import base64
+from utils.serializer import BSONResponse, dumps
+from utils.slot import reserve_slot, book_slot, get_session, skip_numbered, occupancy, MAX_RESERVE_ATTEMPTS
+from utils.counters import next_qnum
+from utils.schedule import doctor_schedule
+from utils.occupancy import OCCUPYING_STATUSES, ACTIVE_FIELD
+from utils.booking_queue import booking_queue
+from utils.events import publish_appointment
+from utils.appointment_status import change_status
+from utils.archive import ARCHIVE_COLLECTION
+from utils.daily_stats import record_stats
 from db import db
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# keyset order of every appointment listing
+APPOINTMENT_ORDER = [("date", 1), ("time", 1), ("_id", 1)]
+# fields returned by appointment listings
+APPOINTMENT_PROJECTION = {
+    "doctor_id": 1, "patient_id": 1, "doctor_name": 1, "patient_name": 1, "date": 1,
+    "time": 1, "qnum": 1, "reason": 1, "status": 1, "created_at": 1,
+}
+
 @router.post("/create/appointment/")
-async def create_appointment(appointment:Appointment,current_user :dict=Depends(get_current_user)):
+async def create_appointment(appointment:Appointment,principal :dict=Depends(get_current_principal)):
+    # place in this doctor's booking queue; a full queue is a real 503 with Retry-After
+    admission = booking_queue.admit(appointment.doctor_id)
     try:
-        patient = await db.patient.find_one({"email":current_user["email"]})
-        if patient["role"] !="patient":
+        if principal["role"] !="patient":
             raise HTTPException(status_code=400, detail="You must be logged in as a patient to book")
         
+        patient = await load_principal(principal)
         if not patient:
             raise HTTPException(status_code=400, detail="Patient not found")     
 
@@ -22,30 +48,24 @@ async def create_appointment(appointment:Appointment,current_user :dict=Depends(
         if not doctor:
             raise HTTPException(status_code=400, detail="Doctor not found")
         
-        datetime.now()
-        last_appointment = await db.appointment.find_one(
-            {"doctor_id": ObjectId(appointment.doctor_id)},
-            sort=[("date", -1), ("time", -1)]
-        )
         patient_name = patient["name"]
         doctor_name = doctor["name"]
-        appointment_date,appointment_time,qnumber = await book_slot(last_appointment,appointment.doctor_id,patient["_id"])
 
         doc = {
             "doctor_id": ObjectId(appointment.doctor_id),
-            "date": appointment_date.isoformat(),
-            "time": appointment_time.strftime("%H:%M:%S"),
             "patient_id": patient["_id"],
             "doctor_name": doctor_name,
             "patient_name": patient_name,
-            "qnum":qnumber,
             "reason": appointment.reason,
             "created_at": datetime.utcnow(),
-            "status": "pending"
+            "status": "pending",
+            ACTIVE_FIELD: True,
         }
-        
-        
-        await db.appointment.insert_one(doc)
+        async with admission:
+            appointment_date,appointment_time,qnumber = await reserve_slot(appointment.doctor_id,doc)
+        publish_appointment("created", doc)
+        await record_stats("booked", [doc])
+
         return {
             "msg": "booked",
             "patient_name": patient_name,
@@ -57,104 +77,281 @@ async def create_appointment(appointment:Appointment,current_user :dict=Depends(
     
     except Exception as e:
         return str(e)
+    finally:
+        admission.close()
 
 
-@router.get("/my_appointments/")
-async def list_appointments(current_user: dict = Depends(get_current_user)):
-    patient = await db.patient.find_one({"email":current_user["email"]})       
-    if patient:
-        query = {"patient_id": patient["_id"]}
+def _failed(index: int, detail: str) -> dict:
+    return {"index": index, "status": "failed", "detail": detail}
 
-        appointments = await db.appointment.find(query).to_list(length=None)
 
-        for a in appointments:
-            a["_id"] = str(a["_id"])
-            if "patient_id" in a: a["patient_id"] = str(a["patient_id"])
-            if "doctor_id" in a: a["doctor_id"] = str(a["doctor_id"])
+async def _bulk_book_round(doctor_id: str, doctor, grid, todo: list, booked_days: set, results: list, booked: list) -> list:
+    """Allocate slots for ``todo`` in memory and write them at once; returns the items to allocate again."""
+    docs, doc_items, retry = [], [], []
+    sessions = {}  # (date, session) -> docs allocated in it
+    for entry in todo:
+        i, item, patient = entry
+        appointment_date, appointment_time = await book_slot(doctor_id)
+        if (patient["_id"], appointment_date.isoformat()) in booked_days:
+            results[i] = _failed(i, "Patient already has an appointment on this day.")
+            continue
 
-        return {"count": len(appointments), "appointments": appointments}
+        doc = {
+            "doctor_id": doctor["_id"],
+            "date": appointment_date.isoformat(),
+            "time": appointment_time.strftime("%H:%M:%S"),
+            "patient_id": patient["_id"],
+            "doctor_name": doctor["name"],
+            "patient_name": patient["name"],
+            "session": await get_session(doctor_id, appointment_date, appointment_time),
+            "slot_minutes": grid.slot_minutes,
+            "reason": item.reason,
+            "created_at": datetime.utcnow(),
+            "status": "pending",
+            ACTIVE_FIELD: True,
+        }
+        # hold the slot in the occupancy index so the next allocation skips it
+        occupancy.apply(doc)
+        booked_days.add((patient["_id"], doc["date"]))
+        docs.append(doc)
+        doc_items.append(entry)
+        sessions.setdefault((doc["date"], doc["session"]), []).append(doc)
 
-    doctor = await db.doctor.find_one({"email":current_user["email"]})       
-    
-    if doctor:
-        query = {"doctor_id": doctor["_id"]}
+    # one counter round trip per session touched, numbered in slot order
+    out_of_order = set()
+    for (day, session), session_docs in sessions.items():
+        session_docs.sort(key=lambda d: d["time"])
+        first = await next_qnum(doctor_id, day, session, session_docs[0]["time"],
+                                session_docs[-1]["time"], count=len(session_docs))
+        if first is None:
+            # the session already numbered a later slot than some of these -> allocate them after it
+            await skip_numbered(doctor_id, day, session)
+            out_of_order.update(id(doc) for doc in session_docs)
+            continue
+        occupancy.mark_numbered(doctor_id, day, session, session_docs[-1]["time"])
+        for n, doc in enumerate(session_docs):
+            doc["qnum"] = first + n
+
+    for n in reversed(range(len(docs))):
+        if id(docs[n]) in out_of_order:
+            doc, entry = docs.pop(n), doc_items.pop(n)
+            occupancy.release(doctor_id, doc["date"], doc["time"])
+            booked_days.discard((doc["patient_id"], doc["date"]))
+            retry.append(entry)
 
-        appointments = await db.appointment.find(query).to_list(length=None)
+    if not docs:
+        return sorted(retry, key=lambda entry: entry[0])
 
-        for a in appointments:
-            a["_id"] = str(a["_id"])
-            if "patient_id" in a: a["patient_id"] = str(a["patient_id"])
-            if "doctor_id" in a: a["doctor_id"] = str(a["doctor_id"])
+    write_errors = {}
+    try:
+        await db.appointment.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        write_errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
 
-        return {"count": len(appointments), "appointments": appointments}
+    for n, ((i, _, _), doc) in enumerate(zip(doc_items, docs)):
+        err = write_errors.get(n)
+        if err is None:
+            publish_appointment("created", doc)
+            booked.append(doc)
+            results[i] = {
+                "index": i,
+                "status": "booked",
+                "id": str(doc["_id"]),
+                "patient_name": doc["patient_name"],
+                "doctor_name": doc["doctor_name"],
+                "date": doc["date"],
+                "time": doc["time"],
+                "qnumber": int(doc["qnum"]),
+            }
+        elif "patient_id" in err.get("keyPattern", {}):
+            occupancy.release(doctor_id, doc["date"], doc["time"])
+            results[i] = _failed(i, "Patient already has an appointment on this day.")
+        else:
+            # the slot went to a concurrent booking: it stays marked as taken, the item takes another one
+            booked_days.discard((doc["patient_id"], doc["date"]))
+            retry.append(doc_items[n])
+    return sorted(retry, key=lambda entry: entry[0])
 
 
-    staff = await db.staff.find_one({"email":current_user["email"]}) 
-    
-    if staff:
-        appointments = await db.appointment.find({}).sort([
-            ("date", 1),
-            ("time", 1)]).to_list(length=None)
-        for a in appointments:
-            a["_id"] = str(a["_id"])
-            if "patient_id" in a: a["patient_id"] = str(a["patient_id"])
-            if "doctor_id" in a: a["doctor_id"] = str(a["doctor_id"])
-
-        return {"count": len(appointments), "appointments": appointments}
+async def _bulk_book_doctor(doctor_id: str, doctor, items: list, patients: dict, booked_days: set, results: list):
+    """Allocate slots for one doctor's share of a bulk booking in memory, then write them at once."""
+    if not doctor:
+        for i, _ in items:
+            results[i] = _failed(i, "Doctor not found")
+        return
+
+    todo = []
+    for i, item in items:
+        patient = patients.get(ObjectId(item.patient_id))
+        if not patient:
+            results[i] = _failed(i, "Patient not found")
+            continue
+        todo.append((i, item, patient))
+    if not todo:
+        return
+
+    grid = await doctor_schedule(doctor_id)
+    # allocate from the doctor's current bookings, not a snapshot up to OCCUPANCY_TTL_SECONDS old
+    occupancy.forget(doctor_id)
+    booked = []
+    for _ in range(MAX_RESERVE_ATTEMPTS):
+        if not todo:
+            break
+        todo = await _bulk_book_round(doctor_id, doctor, grid, todo, booked_days, results, booked)
+    for i, _, _ in todo:
+        results[i] = _failed(i, "Unable to reserve a slot, please try again.")
+
+    await record_stats("booked", booked)
+
+
+async def _bulk_book_doctor_in_turn(doctor_id: str, *args):
+    # takes its turn with single bookings for the same doctor; never rejected
+    async with booking_queue.admit(doctor_id, bounded=False):
+        await _bulk_book_doctor(doctor_id, *args)
+
+
+@router.post("/create/appointments/bulk/")
+async def create_appointments_bulk(bulk: BulkAppointment, principal: dict = Depends(get_current_principal)):
+    if principal["role"] != "staff":
+        raise HTTPException(status_code=403, detail="Only staff can book appointments in bulk")
+
+    results = [None] * len(bulk.appointments)
+    by_doctor = {}
+    for i, item in enumerate(bulk.appointments):
+        if not ObjectId.is_valid(item.patient_id) or not ObjectId.is_valid(item.doctor_id):
+            results[i] = _failed(i, "Invalid patient_id or doctor_id")
+            continue
+        by_doctor.setdefault(item.doctor_id, []).append((i, item))
+
+    # one query each for the patients, the doctors and the patients' upcoming bookings
+    patient_ids = list({ObjectId(item.patient_id) for items in by_doctor.values() for _, item in items})
+    doctor_ids = [ObjectId(doctor_id) for doctor_id in by_doctor]
+    patients = {p["_id"]: p async for p in db.patient.find({"_id": {"$in": patient_ids}}, {"name": 1})}
+    doctors = {d["_id"]: d async for d in db.doctor.find({"_id": {"$in": doctor_ids}}, {"name": 1})}
+    booked_days = {
+        (a["patient_id"], a["date"]) async for a in db.appointment.find(
+            {
+                "patient_id": {"$in": patient_ids},
+                "date": {"$gte": date.today().isoformat()},
+                "status": {"$in": list(OCCUPYING_STATUSES)},
+            },
+            {"_id": 0, "patient_id": 1, "date": 1},
+        )
+    }
+
+    await asyncio.gather(*(
+        _bulk_book_doctor_in_turn(doctor_id, doctors.get(ObjectId(doctor_id)), items, patients, booked_days, results)
+        for doctor_id, items in by_doctor.items()
+    ))
+
+    booked = sum(1 for r in results if r["status"] == "booked")
+    return {"total": len(results), "booked": booked, "failed": len(results) - booked, "results": results}
+
+
+def _encode_cursor(a: dict) -> str:
+    raw = f"{a['date']}|{a['time']}|{a['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> dict:
+    """Keyset filter for everything strictly after the (date, time, _id) in the cursor."""
+    try:
+        last_date, last_time, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        last_id = ObjectId(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"date": {"$gt": last_date}},
+        {"date": last_date, "time": {"$gt": last_time}},
+        {"date": last_date, "time": last_time, "_id": {"$gt": last_id}},
+    ]}
+
+
+def _history(query: dict, include_archived: bool, limit: Optional[int], batch_size: int):
+    """Cursor over matching appointments in keyset order, optionally merged with the archive."""
+    if not include_archived:
+        cursor = db.appointment.find(query, APPOINTMENT_PROJECTION).sort(APPOINTMENT_ORDER).batch_size(batch_size)
+        return cursor.limit(limit) if limit else cursor
+
+    # each side walks its own index; only the (limited) merge is sorted
+    branch = [{"$match": query}, {"$sort": dict(APPOINTMENT_ORDER)}]
+    if limit:
+        branch.append({"$limit": limit})
+    pipeline = branch + [
+        {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": branch}},
+        {"$sort": dict(APPOINTMENT_ORDER)},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": APPOINTMENT_PROJECTION})
+    return db.appointment.aggregate(pipeline, batchSize=batch_size)
+
+
+@router.get("/my_appointments/")
+async def list_appointments(
+    principal: dict = Depends(get_current_principal),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    stream: bool = False,
+    include_archived: bool = False,
+):
+    if principal["role"] == "patient":
+        query = {"patient_id": principal["id"]}
+    elif principal["role"] == "doctor":
+        query = {"doctor_id": principal["id"]}
+    elif principal["role"] == "staff":
+        query = {}
+    else:
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+    if doctor_id and principal["role"] != "doctor":
+        if not ObjectId.is_valid(doctor_id):
+            raise HTTPException(status_code=400, detail="Invalid doctor_id")
+        query["doctor_id"] = ObjectId(doctor_id)
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from: query["date"]["$gte"] = date_from.isoformat()
+        if date_to: query["date"]["$lte"] = date_to.isoformat()
+    if status:
+        query["status"] = status
+    if cursor:
+        query = {"$and": [query, _decode_cursor(cursor)]}
+
+    # NDJSON: every matching appointment, encoded as it comes off the cursor
+    if stream:
+        appointments = _history(query, include_archived, None, limit)
+        async def lines():
+            async for a in appointments:
+                yield dumps(a) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    page = await _history(query, include_archived, limit + 1, limit + 1).to_list(length=limit + 1)
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+
+    return BSONResponse({"count": len(page), "appointments": page, "next_cursor": next_cursor})
     
 
 
 
 #    ===>>>>> CANCEL <<<<<======    
 @router.put("/cancel/appointment/{appointment_id}/")
-async def cancel_appointment(appointment_id: str, current_user: dict = Depends(get_current_user)):
+async def cancel_appointment(appointment_id: str, principal: dict = Depends(get_current_principal)):
     try:
-        appointment = await db.appointment.find_one({"_id": ObjectId(appointment_id)})
-        if not appointment:
-            raise HTTPException(status_code=404, detail="Appointment not found")
-        
-        patient = await db.patient.find_one({"email":current_user["email"]}) 
-        doctor = await db.doctor.find_one({"email":current_user["email"]}) 
-        staff = await db.staff.find_one({"email":current_user["email"]}) 
-        
-        if patient:
-            if str(appointment["patient_id"]) != str(patient["_id"]):
-                raise HTTPException(status_code=403, detail="You can cancel only your own appointments")
-            
-            elif appointment["status"] == "completed":
-                raise HTTPException(status_code=400, detail="Appointment already completed by staff now you can not cancel")
-            else:
-                if appointment["status"] == "cancelled":
-                    raise HTTPException(status_code=400, detail="Appointment already cancelled")
-                
-            await db.appointment.update_one(
-                {"_id": ObjectId(appointment_id)},
-                {"$set": {"status": "cancelled by patient"}}
-            )
-        
-        if doctor:
-            if str(appointment["doctor_id"]) != str(doctor["_id"]):
-                raise HTTPException(status_code=403, detail="You can cancel only your own appointments")
-            else:
-                if appointment["status"] == "cancelled":
-                    raise HTTPException(status_code=400, detail="Appointment already cancelled")
-                
-            await db.appointment.update_one(
-                {"_id": ObjectId(appointment_id)},
-                {"$set": {"status": "cancelled"}}
-            )
-                
-        if staff:
-            if appointment["status"] == "cancelled":
-                    raise HTTPException(status_code=400, detail="Appointment already cancelled")
-
-            await db.appointment.update_one(
-                {"_id": ObjectId(appointment_id)},
-                {"$set": {"status": "cancelled"}}
-            )
+        target = "cancelled by patient" if principal["role"] == "patient" else "cancelled"
+        appointment = await change_status(appointment_id, target, principal)
 
+        occupancy.release(appointment["doctor_id"], appointment["date"], appointment["time"])
+        publish_appointment("cancelled", appointment, target)
+        await record_stats("cancelled", [appointment])
         return {"msg": "Appointment cancelled successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -162,42 +359,16 @@ async def cancel_appointment(appointment_id: str, current_user: dict = Depends(g
 
 #    ===>>>>> COMPLETE <<<<<======    
 @router.put("/complete/appointment/{appointment_id}/")
-async def complete_appointment(appointment_id: str, current_user: dict = Depends(get_current_user)):
+async def complete_appointment(appointment_id: str, principal: dict = Depends(get_current_principal)):
     try:
-        appointment = await db.appointment.find_one({"_id": ObjectId(appointment_id)})
-        if not appointment:
-            raise HTTPException(status_code=404, detail="Appointment not found")
-        
-        
-        patient = await db.patient.find_one({"email":current_user["email"]}) 
-        doctor = await db.doctor.find_one({"email":current_user["email"]}) 
-        staff = await db.staff.find_one({"email":current_user["email"]}) 
-        
-        if patient:
-            raise HTTPException(status_code=403, detail="You can not complete your appointments")
-        
-        if doctor:
-            if str(appointment["doctor_id"]) != str(doctor["_id"]):
-                raise HTTPException(status_code=403, detail="You can complete only your own appointments")
-            
-            elif appointment["status"] == "cancelled by patient":
-                raise HTTPException(status_code=400, detail="Appointment already cancelled by patient now you can not complete")
-            
-            else:
-                if appointment["status"] == "completed":
-                    raise HTTPException(status_code=400, detail="Appointment already completed")
-
-                
-        if staff:
-            if appointment["status"] == "completed":
-                    raise HTTPException(status_code=400, detail="Appointment already completed")
-
-        await db.appointment.update_one(
-            {"_id": ObjectId(appointment_id)},
-            {"$set": {"status": "completed"}}
-        )
+        appointment = await change_status(appointment_id, "completed", principal)
 
+        occupancy.apply({**appointment, "status": "completed"})
+        publish_appointment("completed", appointment, "completed")
+        await record_stats("completed", [appointment])
         return {"msg": "Appointment completed successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,20 +1,29 @@
-from fastapi import APIRouter,HTTPException,Depends
-from models.models import Doctor,DoctorLogin
+from fastapi import APIRouter,HTTPException,Depends,Request,Response,Query
+from models.models import Doctor,DoctorLogin,DoctorSchedule,ScheduleException
 from bson import ObjectId
-from utils.utility import hash_password,create_access_token,verify_password,get_current_user
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from time import monotonic
+import asyncio
+import hashlib
+import os
+from utils.utility import hash_password_async,create_access_token,verify_login_password,access_token_claims,get_current_principal,forget_principal
+from utils.serializer import dumps
+from utils.slot import doctor_availability, availability_cache
+from utils.schedule import DEFAULT_TEMPLATE, DEFAULT_SLOT_MINUTES, validate_sessions, forget_schedule
+from utils.login_throttle import login_throttle, client_ip
 from db import db
 
 router = APIRouter()
 
 @router.post("/doctor/register/")
-async def register(user:Doctor,current_user: dict = Depends(get_current_user)):
+async def register(user:Doctor,principal: dict = Depends(get_current_principal)):
     try:
-        staff = await db.staff.find_one({"email":current_user["email"]})
-        if staff:
+        if principal["role"] == "staff":
             existing = await db.doctor.find_one({"email":user.email})
             if existing:
                 raise HTTPException(status_code=400, detail="Email Already Registered")
-            hashed_pw = hash_password(user.password)
+            hashed_pw = await hash_password_async(user.password)
 
             doc = {
                     "name":user.name,
@@ -27,6 +36,7 @@ async def register(user:Doctor,current_user: dict = Depends(get_current_user)):
                 }
 
             res = await db.doctor.insert_one(doc)
+            invalidate_directory()
             created = await db.doctor.find_one({"_id":res.inserted_id})
             user_data = {
                     "id":str(created["_id"]),
@@ -44,52 +54,214 @@ async def register(user:Doctor,current_user: dict = Depends(get_current_user)):
     
 
 @router.post("/doctor/login/")
-async def login(usertry:DoctorLogin):
+async def login(usertry:DoctorLogin, request: Request):
+    with login_throttle.admit(client_ip(request), usertry.email):
+        try:
+            user = await db.doctor.find_one({"email":usertry.email})
+            if not user or not await verify_login_password(db.doctor, user, usertry.password):
+                raise HTTPException(status_code=400, detail="Incorrect credentials-password")
+            token = create_access_token(access_token_claims(user, "doctor"))
+            return {"message":"Success Login","access_token": token, "token_type": "bearer"}
+        except Exception as e:
+            return str(e)
+    
+
+# Public directory fields; the id is stringified by Mongo itself
+DOCTOR_DIRECTORY_PROJECTION = {
+    "_id": 0,
+    "id": {"$toString": "$_id"},
+    "name": 1,
+    "specialization": 1,
+    "experience_years": 1,
+    "mobile_no": 1,
+    "email": 1,
+}
+
+
+# Serialized /doctors/ body shared by every request. Dropped by register/delete;
+# other workers pick changes up after DIRECTORY_TTL seconds.
+DIRECTORY_TTL = float(os.getenv("DIRECTORY_TTL", "60"))
+_directory = {"body": None, "etag": None, "last_modified": None, "expires_at": 0.0}
+_directory_stats = {"hits": 0, "misses": 0}
+_directory_lock = asyncio.Lock()
+
+
+def invalidate_directory():
+    _directory["body"] = None
+
+
+def directory_cache_stats() -> dict:
+    return dict(_directory_stats)
+
+
+async def _load_directory() -> dict:
+    if _directory["body"] is not None and monotonic() < _directory["expires_at"]:
+        _directory_stats["hits"] += 1
+        return _directory
+
+    async with _directory_lock:
+        # another request may have rebuilt it while we waited
+        if _directory["body"] is not None and monotonic() < _directory["expires_at"]:
+            _directory_stats["hits"] += 1
+            return _directory
+
+        _directory_stats["misses"] += 1
+        doctors = await db.doctor.aggregate([{"$project": DOCTOR_DIRECTORY_PROJECTION}]).to_list(length=None)
+        if not doctors:
+            body = dumps({"msg": "No doctors found."})
+        else:
+            body = dumps({"total": len(doctors), "doctors": doctors})
+
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if etag != _directory["etag"]:
+            _directory["etag"] = etag
+            _directory["last_modified"] = datetime.now(timezone.utc).replace(microsecond=0)
+        _directory["body"] = body
+        _directory["expires_at"] = monotonic() + DIRECTORY_TTL
+        return _directory
+
+
+def _not_modified(request: Request, directory: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or directory["etag"] in tags or f"W/{directory['etag']}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return directory["last_modified"] <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/doctors/")
+async def get_all_doctors(request: Request):
     try:
-        user = await db.doctor.find_one({"email":usertry.email})
-        if not user or not verify_password(usertry.password, user["password"]):
-            raise HTTPException(status_code=400, detail="Incorrect credentials-password")
-        token = create_access_token({"email": usertry.email})
-        return {"message":"Success Login","access_token": token, "token_type": "bearer"}
+        directory = await _load_directory()
     except Exception as e:
-        return str(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {
+        "ETag": directory["etag"],
+        "Last-Modified": format_datetime(directory["last_modified"], usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if _not_modified(request, directory):
+        return Response(status_code=304, headers=headers)
+    return Response(directory["body"], media_type="application/json", headers=headers)
     
 
-@router.get("/doctors/")
-async def get_all_doctors():
+
+
+@router.get("/doctors/{doctor_id}/availability")
+async def get_doctor_availability(doctor_id: str, days: int = Query(7, ge=1, le=30)):
+    if not ObjectId.is_valid(doctor_id):
+        raise HTTPException(status_code=400, detail="Invalid doctor_id")
     try:
-        doctors_cursor = db.doctor.find({}, {"password": 0})
-        doctors = []
-        async for doc in doctors_cursor:
-            doctors.append({
-                "id": str(doc["_id"]),
-                "name": doc.get("name"),
-                "specialization": doc.get("specialization"),
-                "experience_years": doc.get("experience_years"),
-                "mobile_no": doc.get("mobile_no"),
-                "email": doc.get("email")
-            })
-        if not doctors:
-            return {"msg": "No doctors found."}
+        calendar = await doctor_availability(doctor_id, days)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"doctor_id": doctor_id, "days": days, "availability": calendar}
+
+
+async def _schedule_target(doctor_id: str, principal: dict) -> dict:
+    """The doctor whose schedule staff is editing; raises before any write otherwise."""
+    if principal["role"] != "staff":
+        raise HTTPException(status_code=403, detail="Only staff can change doctor schedules")
+    if not ObjectId.is_valid(doctor_id):
+        raise HTTPException(status_code=400, detail="Invalid doctor_id")
+    template = await db.doctor_schedule.find_one({"_id": ObjectId(doctor_id)})
+    if template is None and not await db.doctor.find_one({"_id": ObjectId(doctor_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return template or {}
+
+
+def _schedule_changed(doctor_id: str):
+    forget_schedule(doctor_id)
+    availability_cache.clear()
 
-        return {"total": len(doctors), "doctors": doctors}
 
+@router.get("/doctors/{doctor_id}/schedule")
+async def get_doctor_schedule(doctor_id: str):
+    if not ObjectId.is_valid(doctor_id):
+        raise HTTPException(status_code=400, detail="Invalid doctor_id")
+    try:
+        template = await db.doctor_schedule.find_one({"_id": ObjectId(doctor_id)}, {"_id": 0, "updated_at": 0})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+    today = date.today().isoformat()
+    schedule = {**DEFAULT_TEMPLATE, **(template or {})}
+    schedule["exceptions"] = {day: s for day, s in schedule["exceptions"].items() if day >= today}
+    return {"doctor_id": doctor_id, "custom": template is not None, "schedule": schedule}
+
+
+@router.put("/doctors/{doctor_id}/schedule")
+async def set_doctor_schedule(doctor_id: str, schedule: DoctorSchedule, principal: dict = Depends(get_current_principal)):
+    await _schedule_target(doctor_id, principal)
+    weekly = [[session.model_dump() for session in day] for day in schedule.weekly]
+    try:
+        for sessions in weekly:
+            validate_sessions(sessions, schedule.slot_minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await db.doctor_schedule.update_one(
+        {"_id": ObjectId(doctor_id)},
+        {"$set": {"slot_minutes": schedule.slot_minutes, "weekly": weekly, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    _schedule_changed(doctor_id)
+    return {"msg": "Schedule updated", "doctor_id": doctor_id}
+
+
+@router.put("/doctors/{doctor_id}/schedule/exceptions/{day}")
+async def set_schedule_exception(doctor_id: str, day: date, exception: ScheduleException,
+                                 principal: dict = Depends(get_current_principal)):
+    template = await _schedule_target(doctor_id, principal)
+    sessions = [session.model_dump() for session in exception.sessions]
+    try:
+        validate_sessions(sessions, template.get("slot_minutes") or DEFAULT_SLOT_MINUTES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await db.doctor_schedule.update_one(
+        {"_id": ObjectId(doctor_id)},
+        {"$set": {f"exceptions.{day.isoformat()}": sessions, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    _schedule_changed(doctor_id)
+    return {"msg": "Day off recorded" if not sessions else "Exception recorded",
+            "doctor_id": doctor_id, "date": day.isoformat()}
+
 
+@router.delete("/doctors/{doctor_id}/schedule/exceptions/{day}")
+async def delete_schedule_exception(doctor_id: str, day: date, principal: dict = Depends(get_current_principal)):
+    await _schedule_target(doctor_id, principal)
+    await db.doctor_schedule.update_one(
+        {"_id": ObjectId(doctor_id)},
+        {"$unset": {f"exceptions.{day.isoformat()}": ""}, "$set": {"updated_at": datetime.utcnow()}},
+    )
+    _schedule_changed(doctor_id)
+    return {"msg": "Exception removed", "doctor_id": doctor_id, "date": day.isoformat()}
 
 
 @router.delete("/doctor/{doctor_id}/")
-async def register(doctor_id:str,current_user: dict = Depends(get_current_user)):
+async def register(doctor_id:str,principal: dict = Depends(get_current_principal)):
     try:
-        staff = await db.staff.find_one({"email":current_user["email"]})
-        if staff:
+        if principal["role"] == "staff":
             doctor = await db.doctor.find_one({"_id": ObjectId(doctor_id)})
             if not doctor:
                 raise HTTPException(status_code=400, detail="Doctor Not Found.")
             
             await db.doctor.delete_one({"_id": ObjectId(doctor_id)})
+            await db.doctor_schedule.delete_one({"_id": ObjectId(doctor_id)})
+            forget_principal("doctor", doctor)
+            forget_schedule(doctor_id)
+            invalidate_directory()
            
             return {"msg": "Doctor deleted successfully", "doctor_id": doctor_id}
         
@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from time import perf_counter
+import db as database
+from db import db
+
+router = APIRouter()
+
+
+def _pool() -> dict:
+    return {**database.pool_stats.snapshot(), "max_pool_size": database.client_options().get("maxPoolSize", 100)}
+
+
+@router.get("/health")
+async def health():
+    return {"status": "ok", "pool": _pool()}
+
+
+@router.get("/ready")
+async def ready():
+    start = perf_counter()
+    try:
+        await db.command("ping")
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": str(e), "pool": _pool()})
+    return {"status": "ready", "ping_ms": round((perf_counter() - start) * 1000, 2), "pool": _pool()}
@@ -1,6 +1,7 @@
-from fastapi import APIRouter,HTTPException
+from fastapi import APIRouter,HTTPException,Request
 from models.models import Patient,PatientLogin
-from utils.utility import hash_password,create_access_token,verify_password
+from utils.utility import hash_password_async,create_access_token,verify_login_password,access_token_claims
+from utils.login_throttle import login_throttle, client_ip
 
 from db import db
 
@@ -12,7 +13,7 @@ async def register(user:Patient):
         existing = await db.patient.find_one({"email":user.email})
         if existing:
             raise HTTPException(status_code=400, detail="Email Already Registered")
-        hashed_pw = hash_password(user.password)
+        hashed_pw = await hash_password_async(user.password)
 
         doc = {
                 "name":user.name,
@@ -32,19 +33,20 @@ async def register(user:Patient):
                 "email":created["email"],
                 "medical_history":created["medical_history"]
             }
-        token = create_access_token({"email": user.email})
+        token = create_access_token(access_token_claims(created, "patient"))
         return {"msg": "registered","user": user_data,"access_token": token, "token_type": "bearer"}
     except Exception as e:
         return str(e)
     
 
 @router.post("/patient/login/")
-async def login(usertry:PatientLogin):
-    try:
-        user = await db.patient.find_one({"email":usertry.email})
-        if not user or not verify_password(usertry.password, user["password"]):
-            raise HTTPException(status_code=400, detail="Incorrect credentials-password")
-        token = create_access_token({"email": usertry.email})
-        return {"message":"Success Login","access_token": token, "token_type": "bearer"}
-    except Exception as e:
-        return str(e)
\ No newline at end of file
+async def login(usertry:PatientLogin, request: Request):
+    with login_throttle.admit(client_ip(request), usertry.email):
+        try:
+            user = await db.patient.find_one({"email":usertry.email})
+            if not user or not await verify_login_password(db.patient, user, usertry.password):
+                raise HTTPException(status_code=400, detail="Incorrect credentials-password")
+            token = create_access_token(access_token_claims(user, "patient"))
+            return {"message":"Success Login","access_token": token, "token_type": "bearer"}
+        except Exception as e:
+            return str(e)
\ No newline at end of file
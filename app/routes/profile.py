@@ -1,38 +1,35 @@
 from fastapi import Depends,APIRouter
-from utils.utility import get_current_user
-from db import db
+from utils.utility import get_current_principal,load_principal
 
 router = APIRouter()
 
 @router.get("/profile/")
-async def my_profile(current_user: dict = Depends(get_current_user)):
+async def my_profile(principal: dict = Depends(get_current_principal)):
     try:
-        patient = await db.patient.find_one({"email":current_user["email"]})
-        if patient:
+        user = await load_principal(principal)
+        if principal["role"] == "patient":
             return {
-            "name": patient["name"],
-            "email": patient["email"],
-            "medical_history":patient["medical_history"],
-            "mobile_no" :patient["mobile_no"],
-            "role": patient["role"],
+            "name": user["name"],
+            "email": user["email"],
+            "medical_history":user["medical_history"],
+            "mobile_no" :user["mobile_no"],
+            "role": user["role"],
             }
         
-        doctor = await db.doctor.find_one({"email":current_user["email"]})
-        if doctor:
+        if principal["role"] == "doctor":
             return {
-            "name":doctor["name"],
-            "email": doctor["email"],
-            "mobile_no":doctor["mobile_no"],
-            "experience_years" : doctor["experience_years"],
-            "specialization":doctor["specialization"],
-            "role": doctor["role"],
+            "name":user["name"],
+            "email": user["email"],
+            "mobile_no":user["mobile_no"],
+            "experience_years" : user["experience_years"],
+            "specialization":user["specialization"],
+            "role": user["role"],
             }
         
-        staff = await db.staff.find_one({"email":current_user["email"]})
         return {
-                    "name":staff["name"],
-                    "email": staff["email"],
-                    "mobile_no":staff["mobile_no"],
+                    "name":user["name"],
+                    "email": user["email"],
+                    "mobile_no":user["mobile_no"],
         }
     except Exception as e:
         return str(e)
\ No newline at end of file
@@ -0,0 +1,151 @@
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from datetime import datetime, date
+from time import monotonic
+import asyncio
+import os
+from utils.events import broker, doctor_topic
+from utils.occupancy import OCCUPYING_STATUSES
+from utils.serializer import dumps
+from utils.slot import get_first_available_slot, session_expression
+from db import db
+
+router = APIRouter()
+
+# Seconds between keep-alives on an idle feed (the state is re-checked on each)
+QUEUE_FEED_HEARTBEAT = float(os.getenv("QUEUE_FEED_HEARTBEAT", "15"))
+# A cached snapshot is rebuilt after this long even without events (the next slot moves with time)
+QUEUE_SNAPSHOT_MAX_AGE = float(os.getenv("QUEUE_SNAPSHOT_MAX_AGE", "30"))
+
+# doctor id -> (topic version, date, built at, state); shared by every subscriber of the doctor
+_snapshots = {}
+_snapshot_locks = {}
+
+
+async def _load_queue_state(doctor_id: str, today: str) -> dict:
+    pipeline = [
+        {"$match": {
+            "doctor_id": ObjectId(doctor_id),
+            "date": today,
+            "status": {"$in": list(OCCUPYING_STATUSES)},
+        }},
+        {"$group": {
+            "_id": session_expression(),
+            "starts": {"$min": "$time"},
+            "serving": {"$min": {"$cond": [{"$eq": ["$status", "pending"]}, "$qnum", None]}},
+            "waiting": {"$sum": {"$cond": [{"$eq": ["$status", "pending"]}, 1, 0]}},
+            "completed": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}},
+            "last_issued": {"$max": "$qnum"},
+        }},
+        {"$sort": {"starts": 1}},
+    ]
+    sessions = [
+        {"session": s["_id"], "serving": s["serving"], "waiting": s["waiting"],
+         "completed": s["completed"], "last_issued": s["last_issued"]}
+        async for s in db.appointment.aggregate(pipeline)
+    ]
+
+    try:
+        slot_date, slot_time, _ = await get_first_available_slot(doctor_id, datetime.now().time())
+        next_slot = {"date": slot_date.isoformat(), "time": slot_time.strftime("%H:%M:%S")}
+    except HTTPException:
+        next_slot = None
+    return {"doctor_id": doctor_id, "date": today, "sessions": sessions, "next_slot": next_slot}
+
+
+async def queue_snapshot(doctor_id: str) -> dict:
+    """Today's queue for a doctor, rebuilt at most once per published event."""
+    version = broker.version(doctor_topic(doctor_id))
+    today = date.today().isoformat()
+
+    def current():
+        cached = _snapshots.get(doctor_id)
+        if cached and cached[:2] == (version, today) and monotonic() - cached[2] < QUEUE_SNAPSHOT_MAX_AGE:
+            return cached[3]
+        return None
+
+    state = current()
+    if state is not None:
+        return state
+    async with _snapshot_locks.setdefault(doctor_id, asyncio.Lock()):
+        # another subscriber may have rebuilt it while we waited
+        state = current()
+        if state is None:
+            state = await _load_queue_state(doctor_id, today)
+            _snapshots[doctor_id] = (version, today, monotonic(), state)
+    return state
+
+
+def _forget_if_idle(doctor_id: str):
+    if not broker.subscribers(doctor_topic(doctor_id)):
+        _snapshots.pop(doctor_id, None)
+        _snapshot_locks.pop(doctor_id, None)
+
+
+async def _subscribe(doctor_id: str):
+    if not ObjectId.is_valid(doctor_id):
+        raise HTTPException(status_code=400, detail="Invalid doctor_id")
+    if not await db.doctor.find_one({"_id": ObjectId(doctor_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return broker.subscribe(doctor_topic(doctor_id))
+
+
+async def _queue_updates(doctor_id: str, subscription):
+    """Yield the doctor's queue state whenever it changes, or None when a keep-alive is due.
+
+    Events that pile up while the client is slow are coalesced into one snapshot.
+    """
+    last = None
+    while True:
+        state = await queue_snapshot(doctor_id)
+        if state != last:
+            last = state
+            yield state
+        if not await subscription.get(timeout=QUEUE_FEED_HEARTBEAT):
+            yield None
+
+
+@router.get("/queue/{doctor_id}/events")
+async def queue_events(doctor_id: str, request: Request):
+    """Server-Sent Events feed of a doctor's queue (``event: queue``)."""
+    subscription = await _subscribe(doctor_id)
+
+    async def stream():
+        try:
+            async for state in _queue_updates(doctor_id, subscription):
+                if state is None:
+                    if await request.is_disconnected():
+                        break
+                    yield b": keep-alive\n\n"
+                else:
+                    yield b"event: queue\ndata: " + dumps(state) + b"\n\n"
+        finally:
+            subscription.close()
+            _forget_if_idle(doctor_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/queue/{doctor_id}/ws")
+async def queue_socket(websocket: WebSocket, doctor_id: str):
+    """WebSocket feed of a doctor's queue: ``{"event": "queue", "data": {...}}`` messages."""
+    try:
+        subscription = await _subscribe(doctor_id)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    try:
+        async for state in _queue_updates(doctor_id, subscription):
+            if state is None:
+                await websocket.send_text('{"event":"heartbeat"}')
+            else:
+                await websocket.send_text(dumps({"event": "queue", "data": state}).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
+        _forget_if_idle(doctor_id)
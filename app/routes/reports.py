@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, HTTPException
+from bson import ObjectId
+from datetime import date, timedelta
+from typing import Optional
+from utils.utility import get_current_principal
+from utils.daily_stats import STATS_COLLECTION, STATS_FIELDS
+from utils.schedule import DEFAULT_GRID, compile_template
+from db import db
+
+router = APIRouter()
+
+# longest range a report may cover, in days
+MAX_REPORT_DAYS = 366
+
+
+def _capacity(grid, first: date, last: date) -> dict:
+    """Bookable slots per session between ``first`` and ``last`` (inclusive)."""
+    capacity = {}
+    day = first
+    while day <= last:
+        for name, mask in grid.day(day).sessions:
+            capacity[name] = capacity.get(name, 0) + mask.bit_count()
+        day += timedelta(days=1)
+    return capacity
+
+
+def _rollup(counts: dict, capacity: int) -> dict:
+    active = counts["booked"] - counts["cancelled"]
+    return {**counts, "capacity": capacity,
+            "utilization": round(active / capacity, 4) if capacity else None}
+
+
+@router.get("/reports/doctor-utilization/")
+async def doctor_utilization(
+    date_from: date,
+    date_to: date,
+    doctor_id: Optional[str] = None,
+    principal: dict = Depends(get_current_principal),
+):
+    """Booked / completed / cancelled appointments and slot utilization per doctor and session."""
+    if principal["role"] != "staff":
+        raise HTTPException(status_code=403, detail="Only staff can view reports")
+    if date_to < date_from or (date_to - date_from).days >= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"date_to must be within {MAX_REPORT_DAYS} days after date_from")
+    if doctor_id and not ObjectId.is_valid(doctor_id):
+        raise HTTPException(status_code=400, detail="Invalid doctor_id")
+
+    match = {"date": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+    if doctor_id:
+        match["doctor_id"] = ObjectId(doctor_id)
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "session": "$session"},
+            **{field: {"$sum": f"${field}"} for field in STATS_FIELDS},
+        }},
+    ]
+
+    try:
+        rows = await db[STATS_COLLECTION].aggregate(pipeline).to_list(length=None)
+        doctor_ids = list({row["_id"]["doctor_id"] for row in rows})
+        names = {d["_id"]: d["name"] async for d in db.doctor.find({"_id": {"$in": doctor_ids}}, {"name": 1})}
+        templates = {t["_id"]: t async for t in db.doctor_schedule.find({"_id": {"$in": doctor_ids}})}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    doctors = {}
+    for row in rows:
+        key = row["_id"]["doctor_id"]
+        doctors.setdefault(key, {})[row["_id"]["session"]] = {field: row[field] for field in STATS_FIELDS}
+
+    report = []
+    for key, sessions in doctors.items():
+        template = templates.get(key)
+        # compiled from date_from so exceptions inside the range still count
+        grid = compile_template(template, today=date_from) if template else DEFAULT_GRID
+        capacity = _capacity(grid, date_from, date_to)
+        totals = {field: sum(s[field] for s in sessions.values()) for field in STATS_FIELDS}
+        report.append({
+            "doctor_id": str(key),
+            "doctor_name": names.get(key),
+            **_rollup(totals, sum(capacity.values())),
+            "sessions": {
+                name: _rollup(sessions.get(name, dict.fromkeys(STATS_FIELDS, 0)), capacity.get(name, 0))
+                for name in sorted(set(sessions) | set(capacity))
+            },
+        })
+    report.sort(key=lambda r: -r["booked"])
+
+    return {"date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "doctors": report}
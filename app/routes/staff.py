@@ -1,6 +1,7 @@
 from models.models import Staff,StaffLogin
-from fastapi import APIRouter,HTTPException
-from utils.utility import hash_password,create_access_token,verify_password
+from fastapi import APIRouter,HTTPException,Request
+from utils.utility import hash_password_async,create_access_token,verify_login_password,access_token_claims
+from utils.login_throttle import login_throttle, client_ip
 import os
 from db import db
 
@@ -13,7 +14,7 @@ async def register(user:Staff,admin:str):
             existing = await db.staff.find_one({"email":user.email})
             if existing:
                 raise HTTPException(status_code=400, detail="Email Already Registered")
-            hashed_pw = hash_password(user.password)
+            hashed_pw = await hash_password_async(user.password)
 
             doc = {
                     "name":user.name,
@@ -38,12 +39,13 @@ async def register(user:Staff,admin:str):
 
 
 @router.post("/staff/login/")
-async def login(usertry:StaffLogin):
-    try:
-        user = await db.staff.find_one({"email":usertry.email})
-        if not user or not verify_password(usertry.password, user["password"]):
-            raise HTTPException(status_code=400, detail="Incorrect credentials-password")
-        token = create_access_token({"email": usertry.email})
-        return {"message":"Success Login","access_token": token, "token_type": "bearer"}
-    except Exception as e:
-        return str(e)
\ No newline at end of file
+async def login(usertry:StaffLogin, request: Request):
+    with login_throttle.admit(client_ip(request), usertry.email):
+        try:
+            user = await db.staff.find_one({"email":usertry.email})
+            if not user or not await verify_login_password(db.staff, user, usertry.password):
+                raise HTTPException(status_code=400, detail="Incorrect credentials-password")
+            token = create_access_token(access_token_claims(user, "staff"))
+            return {"message":"Success Login","access_token": token, "token_type": "bearer"}
+        except Exception as e:
+            return str(e)
\ No newline at end of file
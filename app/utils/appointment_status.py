@@ -0,0 +1,82 @@
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from db import db
+from utils.occupancy import OCCUPYING_STATUSES, ACTIVE_FIELD
+
+# status -> statuses it may move to; anything not listed is final
+TRANSITIONS = {
+    "pending": ("completed", "cancelled", "cancelled by patient"),
+}
+# role -> statuses it may set
+ROLE_TARGETS = {
+    "patient": ("cancelled by patient",),
+    "doctor": ("completed", "cancelled"),
+    "staff": ("completed", "cancelled"),
+}
+# role -> appointment field that must hold the principal's id
+OWNER_FIELDS = {"patient": "patient_id", "doctor": "doctor_id"}
+
+# fields callers need after a change (occupancy, queue events, daily stats)
+STATUS_PROJECTION = {"doctor_id": 1, "patient_id": 1, "date": 1, "time": 1, "session": 1, "qnum": 1, "slot_minutes": 1,
+                     "status": 1}
+
+
+def _previous_statuses(target: str) -> list:
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+def _rejection(appointment: dict, target: str, principal: dict) -> HTTPException:
+    """Why the conditional update matched nothing, worded like the original checks."""
+    action = "complete" if target == "completed" else "cancel"
+    if appointment is None:
+        return HTTPException(status_code=404, detail="Appointment not found")
+    owner_field = OWNER_FIELDS.get(principal["role"])
+    if owner_field and appointment[owner_field] != principal["id"]:
+        return HTTPException(status_code=403, detail=f"You can {action} only your own appointments")
+
+    status = appointment["status"]
+    if status == "completed" and action == "cancel" and principal["role"] == "patient":
+        detail = "Appointment already completed by staff now you can not cancel"
+    elif status == "cancelled by patient" and action == "complete":
+        detail = "Appointment already cancelled by patient now you can not complete"
+    elif status.startswith("cancelled"):
+        detail = "Appointment already cancelled"
+    elif status == "completed":
+        detail = "Appointment already completed"
+    else:
+        detail = f"Appointment is {status}, you can not {action} it"
+    return HTTPException(status_code=400, detail=detail)
+
+
+async def change_status(appointment_id: str, target: str, principal: dict) -> dict:
+    """Move an appointment to ``target`` in one conditional write and return it as it was.
+
+    The filter carries the ownership and allowed-previous-status checks, so a
+    concurrent change can never be overwritten; the appointment is only read
+    again when the write is rejected, to explain why.
+    """
+    if target not in ROLE_TARGETS.get(principal["role"], ()):
+        if target == "completed":
+            raise HTTPException(status_code=403, detail="You can not complete your appointments")
+        raise HTTPException(status_code=403, detail="You can not cancel this appointment")
+
+    query = {"_id": ObjectId(appointment_id), "status": {"$in": _previous_statuses(target)}}
+    owner_field = OWNER_FIELDS.get(principal["role"])
+    if owner_field:
+        query[owner_field] = principal["id"]
+
+    update = {"$set": {"status": target}}
+    if target not in OCCUPYING_STATUSES:
+        # leaves the unique slot indexes, freeing the slot and the patient's day
+        update["$unset"] = {ACTIVE_FIELD: ""}
+    previous = await db.appointment.find_one_and_update(
+        query,
+        update,
+        projection=STATUS_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous is None:
+        current = await db.appointment.find_one({"_id": ObjectId(appointment_id)}, STATUS_PROJECTION)
+        raise _rejection(current, target, principal)
+    return previous
@@ -0,0 +1,110 @@
+"""Hot/cold split of appointments: finished, past-dated ones move to ``appointment_archive``.
+
+The app runs the archiver in the background (``ARCHIVE_INTERVAL_SECONDS``, 0 to
+disable); one pass can also be run by hand (from the app directory):
+
+    python -m utils.archive
+"""
+import asyncio
+import os
+import sys
+from datetime import date, timedelta
+from dotenv import load_dotenv
+load_dotenv()
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError
+import db as database
+from db import db
+
+ARCHIVE_COLLECTION = "appointment_archive"
+# statuses that never change again (see utils.appointment_status)
+FINISHED_STATUSES = ("completed", "cancelled", "cancelled by patient")
+# finished appointments dated at least this many days ago are archived
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "1"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+ARCHIVE_INDEXES = [
+    IndexModel([("patient_id", 1), ("date", 1), ("time", 1), ("_id", 1)], name="patient_history"),
+    IndexModel([("doctor_id", 1), ("date", 1), ("time", 1), ("_id", 1)], name="doctor_schedule"),
+    IndexModel([("date", 1), ("time", 1), ("_id", 1)], name="schedule"),
+]
+
+_DUPLICATE_KEY = 11000
+
+
+async def archive_batch(cutoff: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to ``batch_size`` finished appointments dated before ``cutoff``; returns how many.
+
+    Copy first, delete second: a batch interrupted in between (or run by two
+    workers at once) is simply copied again, the archive already holding the ids.
+    """
+    finished = {"date": {"$lt": cutoff}, "status": {"$in": list(FINISHED_STATUSES)}}
+    docs = await db.appointment.find(finished).sort("date", 1).limit(batch_size).to_list(length=batch_size)
+    if not docs:
+        return 0
+
+    try:
+        await db[ARCHIVE_COLLECTION].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != _DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+            raise
+    await db.appointment.delete_many({**finished, "_id": {"$in": [d["_id"] for d in docs]}})
+    return len(docs)
+
+
+async def archive_finished(today: date = None) -> int:
+    """Archive everything that is due, batch by batch; returns how many were moved."""
+    cutoff = ((today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS - 1)).isoformat()
+    moved = 0
+    while True:
+        count = await archive_batch(cutoff)
+        moved += count
+        if count < ARCHIVE_BATCH_SIZE:
+            return moved
+        # let requests run between batches
+        await asyncio.sleep(0)
+
+
+async def _archive_forever():
+    while True:
+        try:
+            moved = await archive_finished()
+            if moved:
+                print(f"📦 Archived {moved} appointments")
+        except Exception as e:
+            print(f"❌ Error archiving appointments: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+_task = None
+
+
+def start_archiver():
+    global _task
+    if ARCHIVE_INTERVAL_SECONDS > 0 and _task is None:
+        _task = asyncio.create_task(_archive_forever())
+
+
+async def stop_archiver():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+async def _main():
+    database.connect()
+    await db[ARCHIVE_COLLECTION].create_indexes(ARCHIVE_INDEXES)
+    print(f"✅ {await archive_finished()} appointments archived")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(_main())
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from fastapi import HTTPException
+
+# Bookings admitted per doctor at once (running + waiting); 0 = unbounded
+BOOKING_QUEUE_DEPTH = int(os.getenv("BOOKING_QUEUE_DEPTH", "32"))
+BOOKING_RETRY_AFTER_SECONDS = int(os.getenv("BOOKING_RETRY_AFTER_SECONDS", "1"))
+
+
+class _Admission:
+    """A booking's place in its doctor's queue; ``async with`` it to run the allocation."""
+
+    __slots__ = ("_queue", "_key", "_entry", "_open")
+
+    def __init__(self, queue, key: str, entry: list):
+        self._queue = queue
+        self._key = key
+        self._entry = entry
+        self._open = True
+
+    async def __aenter__(self):
+        await self._entry[0].acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self._entry[0].release()
+        self.close()
+
+    def close(self):
+        """Give the place back (idempotent; also done on leaving ``async with``)."""
+        if self._open:
+            self._open = False
+            self._queue._leave(self._key, self._entry)
+
+
+class BookingQueue:
+    """Serializes slot allocation per doctor within this process.
+
+    Bookings for one doctor take turns on that doctor's lock, so each allocates
+    from the occupancy the previous one left behind instead of racing it for the
+    same slot; different doctors still run in parallel. At most ``depth``
+    bookings per doctor are admitted; the next one gets a 503 straight away.
+    """
+
+    def __init__(self, depth: int, retry_after: int):
+        self.depth = depth
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._doctors = {}  # doctor id -> [lock, admitted]
+
+    def admit(self, doctor_id, bounded: bool = True) -> _Admission:
+        key = str(doctor_id)
+        entry = self._doctors.get(key)
+        if entry is None:
+            entry = self._doctors[key] = [asyncio.Lock(), 0]
+        if bounded and self.depth and entry[1] >= self.depth:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many bookings for this doctor right now, please retry.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        entry[1] += 1
+        return _Admission(self, key, entry)
+
+    def _leave(self, key: str, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0 and self._doctors.get(key) is entry:
+            del self._doctors[key]
+
+    def stats(self) -> dict:
+        return {
+            "doctors": len(self._doctors),
+            "admitted": sum(entry[1] for entry in self._doctors.values()),
+            "rejected": self.rejected,
+            "depth": self.depth,
+        }
+
+
+booking_queue = BookingQueue(BOOKING_QUEUE_DEPTH, BOOKING_RETRY_AFTER_SECONDS)
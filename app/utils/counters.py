@@ -0,0 +1,111 @@
+"""Per-session queue number counters: one document per doctor, date and session.
+
+Each counter keeps the last number it handed out (``seq``) and the latest slot
+time it numbered (``last_time``), so numbers follow the order patients are seen.
+
+Rebuild them from the existing appointments (run from the app directory):
+
+    python -m utils.counters --rebuild
+"""
+import asyncio
+import sys
+from typing import Optional
+from dotenv import load_dotenv
+load_dotenv()
+from bson import ObjectId
+from pymongo import IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import db as database
+from db import db
+
+COUNTER_INDEXES = [
+    IndexModel([("doctor_id", 1), ("date", 1), ("session", 1)], name="session_unique", unique=True),
+]
+
+
+def _counter_key(doctor_id, day: str, session: str) -> dict:
+    return {"doctor_id": ObjectId(doctor_id), "date": day, "session": session}
+
+
+async def next_qnum(doctor_id, day: str, session: str, first_time: str,
+                    last_time: Optional[str] = None, count: int = 1) -> Optional[int]:
+    """Atomically reserve ``count`` consecutive queue numbers for the slots from
+    ``first_time`` to ``last_time`` (default ``first_time``) and return the first.
+
+    Returns None when the session already numbered a slot at or after
+    ``first_time``: a freed earlier slot is not numbered again, so the caller
+    moves on past ``numbered_until()``.
+    """
+    key = _counter_key(doctor_id, day, session)
+    # the counter is created by the first booking of the session; a missing
+    # last_time is a counter rebuilt before slot times were recorded
+    in_order = {"$or": [{"last_time": {"$lt": first_time}}, {"last_time": {"$exists": False}}]}
+    for upsert in (True, False):
+        try:
+            # the document before the update: the filter no longer matches it afterwards
+            before = await db.appointment_counter.find_one_and_update(
+                {**key, **in_order},
+                {"$inc": {"seq": count}, "$max": {"last_time": last_time or first_time}},
+                projection={"_id": 0, "seq": 1},
+                upsert=upsert,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            # the counter exists (numbered a later slot, or a concurrent booking created it): retry without upsert
+            continue
+        if before is None:
+            return 1 if upsert else None  # created by this call / out of order
+        return before.get("seq", 0) + 1
+    return None
+
+
+async def numbered_until(doctor_id, day: str, session: str) -> Optional[str]:
+    """Latest slot time the session's counter has numbered, otherwise None."""
+    counter = await db.appointment_counter.find_one(_counter_key(doctor_id, day, session), {"_id": 0, "last_time": 1})
+    return (counter or {}).get("last_time")
+
+
+async def rebuild_counters(session_expression: dict):
+    """Set every counter to the highest queue number and latest slot already handed out in its session.
+
+    ``session_expression`` maps an appointment to its session name (see
+    ``utils.slot.session_expression``).
+    """
+    pipeline = [
+        {"$match": {"qnum": {"$type": "number"}}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "date": "$date", "session": session_expression},
+            "seq": {"$max": "$qnum"},
+            "last_time": {"$max": "$time"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "doctor_id": "$_id.doctor_id",
+            "date": "$_id.date",
+            "session": "$_id.session",
+            "seq": 1,
+            "last_time": 1,
+        }},
+        {"$merge": {
+            "into": "appointment_counter",
+            "on": ["doctor_id", "date", "session"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert",
+        }},
+    ]
+    await db.appointment.aggregate(pipeline).to_list(length=None)
+
+
+async def _main():
+    from utils.slot import session_expression
+    database.connect()
+    await db.appointment_counter.create_indexes(COUNTER_INDEXES)
+    await rebuild_counters(session_expression())
+    print(f"✅ {await db.appointment_counter.count_documents({})} queue counters rebuilt")
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(_main())
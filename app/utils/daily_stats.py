@@ -0,0 +1,100 @@
+"""Booked / completed / cancelled appointments per doctor, date and session.
+
+Kept up to date by the appointment routes; rebuild it from the appointments
+(hot and archived) with (from the app directory):
+
+    python -m utils.daily_stats --rebuild
+"""
+import asyncio
+import sys
+from dotenv import load_dotenv
+load_dotenv()
+from pymongo import IndexModel, UpdateOne
+import db as database
+from db import db
+from utils.slot import appointment_session, session_expression
+from utils.archive import ARCHIVE_COLLECTION
+
+STATS_COLLECTION = "doctor_daily_stats"
+STATS_INDEXES = [
+    IndexModel([("doctor_id", 1), ("date", 1), ("session", 1)], name="doctor_day_session_unique", unique=True),
+    # reports over every doctor for a date range
+    IndexModel([("date", 1), ("doctor_id", 1)], name="date_doctor"),
+]
+# counters of each row; also the events record() accepts
+STATS_FIELDS = ("booked", "completed", "cancelled")
+
+
+def _key(appointment: dict) -> tuple:
+    return appointment["doctor_id"], appointment["date"], appointment_session(appointment)
+
+
+async def record_stats(event: str, appointments: list):
+    """Count ``event`` ("booked", "completed" or "cancelled") for each appointment.
+
+    Never fails the caller: the stats can always be rebuilt.
+    """
+    counts = {}
+    for appointment in appointments:
+        key = _key(appointment)
+        counts[key] = counts.get(key, 0) + 1
+    if not counts:
+        return
+    updates = [
+        ({"doctor_id": doctor_id, "date": day, "session": session}, {"$inc": {event: count}})
+        for (doctor_id, day, session), count in counts.items()
+    ]
+    try:
+        if len(updates) == 1:
+            await db[STATS_COLLECTION].update_one(*updates[0], upsert=True)
+        else:
+            await db[STATS_COLLECTION].bulk_write(
+                [UpdateOne(query, update, upsert=True) for query, update in updates], ordered=False)
+    except Exception as e:
+        print(f"❌ Error updating daily stats: {e}")
+
+
+async def rebuild_stats():
+    """Recompute every row from the appointments and their archive."""
+    def counted(status_values):
+        return {"$sum": {"$cond": [{"$in": ["$status", status_values]}, 1, 0]}}
+
+    pipeline = [
+        {"$unionWith": {"coll": ARCHIVE_COLLECTION}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "date": "$date", "session": session_expression()},
+            "booked": {"$sum": 1},
+            "completed": counted(["completed"]),
+            "cancelled": counted(["cancelled", "cancelled by patient"]),
+        }},
+        {"$project": {
+            "_id": 0,
+            "doctor_id": "$_id.doctor_id",
+            "date": "$_id.date",
+            "session": "$_id.session",
+            "booked": 1,
+            "completed": 1,
+            "cancelled": 1,
+        }},
+        {"$merge": {
+            "into": STATS_COLLECTION,
+            "on": ["doctor_id", "date", "session"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ]
+    await db.appointment.aggregate(pipeline).to_list(length=None)
+
+
+async def _main():
+    database.connect()
+    await db[STATS_COLLECTION].create_indexes(STATS_INDEXES)
+    await rebuild_stats()
+    print(f"✅ {await db[STATS_COLLECTION].count_documents({})} daily stats rows rebuilt")
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(_main())
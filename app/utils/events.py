@@ -0,0 +1,112 @@
+import asyncio
+import os
+from fastapi import HTTPException
+
+# Events buffered per subscriber before the oldest are dropped
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "16"))
+# Live subscriptions allowed per process
+MAX_SUBSCRIBERS = int(os.getenv("MAX_SUBSCRIBERS", "1000"))
+
+
+class Subscription:
+    """One subscriber's bounded buffer of events on a topic.
+
+    A subscriber that falls behind loses its oldest events rather than slowing
+    the publisher down; ``dropped`` tells it so, and subscribers that only render
+    the latest state simply catch up on the next event.
+    """
+
+    def __init__(self, broker, topic: str, maxsize: int):
+        self._broker = broker
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _offer(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float = None) -> list:
+        """Wait for the next event, then return it with everything else already buffered.
+
+        Returns an empty list when ``timeout`` expires first.
+        """
+        try:
+            events = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+    def close(self):
+        self._broker._unsubscribe(self)
+
+
+class EventBroker:
+    """In-process pub/sub: ``publish`` never blocks and never fails the caller."""
+
+    def __init__(self, buffer_size: int, max_subscribers: int):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self._topics = {}  # topic -> set of Subscription
+        self._versions = {}  # topic -> events published since it got its first subscriber
+        self._count = 0
+
+    def subscribe(self, topic: str) -> Subscription:
+        if self._count >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many live subscribers, please poll instead.")
+        subscription = Subscription(self, topic, self.buffer_size)
+        self._topics.setdefault(topic, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is not None and subscription in subscribers:
+            subscribers.discard(subscription)
+            self._count -= 1
+            if not subscribers:
+                del self._topics[subscription.topic]
+                self._versions.pop(subscription.topic, None)
+
+    def publish(self, topic: str, event: dict):
+        self.published += 1
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return
+        self._versions[topic] = self._versions.get(topic, 0) + 1
+        for subscription in subscribers:
+            subscription._offer(event)
+
+    def version(self, topic: str) -> int:
+        """Changes with every event published on ``topic`` while it has subscribers."""
+        return self._versions.get(topic, 0)
+
+    def subscribers(self, topic: str) -> int:
+        return len(self._topics.get(topic, ()))
+
+    def stats(self) -> dict:
+        return {"topics": len(self._topics), "subscribers": self._count, "published": self.published}
+
+
+broker = EventBroker(EVENT_BUFFER_SIZE, MAX_SUBSCRIBERS)
+
+
+def doctor_topic(doctor_id) -> str:
+    return f"doctor:{doctor_id}"
+
+
+def publish_appointment(kind: str, appointment: dict, status: str = None):
+    """Announce a created / cancelled / completed appointment on its doctor's topic."""
+    broker.publish(doctor_topic(appointment["doctor_id"]), {
+        "type": kind,
+        "doctor_id": str(appointment["doctor_id"]),
+        "date": appointment.get("date"),
+        "time": appointment.get("time"),
+        "qnum": appointment.get("qnum"),
+        "status": status or appointment.get("status"),
+    })
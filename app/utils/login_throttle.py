@@ -0,0 +1,133 @@
+import math
+import os
+from time import monotonic
+from fastapi import HTTPException
+from utils.cache import TTLCache
+
+# Token buckets: RATE attempts per minute refill a bucket of BURST; 0 disables that bucket
+LOGIN_IP_RATE_PER_MINUTE = float(os.getenv("LOGIN_IP_RATE_PER_MINUTE", "30"))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "10"))
+LOGIN_EMAIL_RATE_PER_MINUTE = float(os.getenv("LOGIN_EMAIL_RATE_PER_MINUTE", "5"))
+LOGIN_EMAIL_BURST = int(os.getenv("LOGIN_EMAIL_BURST", "5"))
+# Password checks in flight across all login routes; 0 = unbounded
+LOGIN_MAX_CONCURRENT = int(os.getenv("LOGIN_MAX_CONCURRENT", "16"))
+# Buckets kept per kind; the least recently used are dropped first
+LOGIN_THROTTLE_KEYS = int(os.getenv("LOGIN_THROTTLE_KEYS", "100000"))
+
+
+class TokenBuckets:
+    """One token bucket per key (client IP, email, ...).
+
+    An idle bucket refills completely after ``burst / rate`` seconds, so it is
+    only kept that long: a dropped bucket and a full one behave the same.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, maxsize: int):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.enabled = self.rate > 0 and burst > 0
+        self._buckets = TTLCache(maxsize=maxsize, ttl=burst / self.rate if self.enabled else 0)
+
+    def _tokens(self, key, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.burst
+        tokens, updated = entry
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait(self, key) -> float:
+        """Seconds until ``key`` has a token (0 = one is available now)."""
+        if not self.enabled:
+            return 0
+        tokens = self._tokens(key, monotonic())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key):
+        if not self.enabled:
+            return
+        now = monotonic()
+        tokens = self._tokens(key, now) - 1
+        # kept until it would be full again
+        self._buckets.set(key, (tokens, now), ttl=(self.burst - tokens) / self.rate)
+
+    def stats(self) -> dict:
+        return {"keys": self._buckets.stats()["size"], "rate_per_minute": self.rate * 60, "burst": self.burst}
+
+
+class _Check:
+    """A password check's slot under the concurrency cap; ``with`` it around the login."""
+
+    __slots__ = ("_throttle", "_open")
+
+    def __init__(self, throttle):
+        self._throttle = throttle
+        self._open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._open:
+            self._open = False
+            self._throttle.in_flight -= 1
+
+
+class LoginThrottle:
+    """Rejects login attempts with a 429 before any bcrypt work is done.
+
+    An attempt needs a token from both its client IP's bucket and its email's
+    bucket, and a free slot under ``max_concurrent`` password checks in this
+    process; the cap sheds load instead of queueing it behind the hash pool.
+    """
+
+    def __init__(self, by_ip: TokenBuckets, by_email: TokenBuckets, max_concurrent: int):
+        self.by_ip = by_ip
+        self.by_email = by_email
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = {"ip": 0, "email": 0, "concurrency": 0}
+
+    def _reject(self, reason: str, retry_after: float, detail: str):
+        self.rejected[reason] += 1
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def admit(self, client_ip, email: str) -> _Check:
+        email = email.strip().lower()
+        ip_wait = self.by_ip.wait(client_ip)
+        if ip_wait:
+            self._reject("ip", ip_wait, "Too many login attempts from this address, please retry later.")
+        email_wait = self.by_email.wait(email)
+        if email_wait:
+            self._reject("email", email_wait, "Too many login attempts for this account, please retry later.")
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            self._reject("concurrency", 1, "Too many logins in progress, please retry.")
+        # only attempts that get to check a password use up tokens
+        self.by_ip.take(client_ip)
+        self.by_email.take(email)
+        self.in_flight += 1
+        return _Check(self)
+
+    def stats(self) -> dict:
+        return {
+            "ip": self.by_ip.stats(),
+            "email": self.by_email.stats(),
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "rejected": dict(self.rejected),
+        }
+
+
+login_throttle = LoginThrottle(
+    TokenBuckets(LOGIN_IP_RATE_PER_MINUTE, LOGIN_IP_BURST, LOGIN_THROTTLE_KEYS),
+    TokenBuckets(LOGIN_EMAIL_RATE_PER_MINUTE, LOGIN_EMAIL_BURST, LOGIN_THROTTLE_KEYS),
+    LOGIN_MAX_CONCURRENT,
+)
+
+
+def client_ip(request) -> str:
+    """The caller's address (behind a proxy, run uvicorn with --proxy-headers)."""
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,163 @@
+"""Per-route request metrics and Mongo command metrics in Prometheus text format."""
+from contextvars import ContextVar
+from pymongo import monitoring
+from time import perf_counter
+import os
+import threading
+import uuid
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+
+
+class RequestStats:
+    """What the current request has done so far; shared with driver threads via a context var."""
+
+    __slots__ = ("request_id", "scope", "route", "db_calls", "db_seconds")
+
+    def __init__(self, request_id: str, scope: dict = None):
+        self.request_id = request_id
+        self.scope = scope
+        self.route = None
+        self.db_calls = 0
+        self.db_seconds = 0.0
+
+
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+_lock = threading.Lock()
+_requests = {}   # (method, route, status) -> count
+_latency = {}    # (method, route) -> [bucket counts..., +Inf count, sum]
+_route_db = {}   # (method, route) -> [db calls, db seconds]
+_commands = {}   # command name -> [count, failures, seconds]
+
+
+def route_of(scope: dict) -> str:
+    """Route template (``/cancel/appointment/{appointment_id}/``) once the router has matched."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _observe_request(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    with _lock:
+        key = (method, route, status)
+        _requests[key] = _requests.get(key, 0) + 1
+
+        histogram = _latency.setdefault((method, route), [0] * (len(LATENCY_BUCKETS) + 2))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+        db = _route_db.setdefault((method, route), [0, 0.0])
+        db[0] += stats.db_calls
+        db[1] += stats.db_seconds
+
+
+async def track_request(request, call_next):
+    """HTTP middleware body: time the request and attribute its Mongo commands to it."""
+    stats = RequestStats(request.headers.get("x-request-id") or uuid.uuid4().hex, request.scope)
+    token = current_request.set(stats)
+    start = perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        stats.route = route_of(request.scope)
+        _observe_request(request.method, stats.route, 500, perf_counter() - start, stats)
+        raise
+    finally:
+        current_request.reset(token)
+
+    stats.route = route_of(request.scope)
+    _observe_request(request.method, stats.route, response.status_code, perf_counter() - start, stats)
+    response.headers["X-Request-ID"] = stats.request_id
+    if DEBUG:
+        response.headers["X-DB-Calls"] = str(stats.db_calls)
+    return response
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Counts Mongo commands globally and for the request that issued them."""
+
+    def _record(self, event, failed: bool):
+        seconds = event.duration_micros / 1_000_000
+        with _lock:
+            command = _commands.setdefault(event.command_name, [0, 0, 0.0])
+            command[0] += 1
+            command[1] += 1 if failed else 0
+            command[2] += seconds
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_calls += 1
+            stats.db_seconds += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+
+command_metrics = CommandMetrics()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(extra_gauges: dict = None) -> str:
+    """Prometheus text exposition of everything collected so far.
+
+    ``extra_gauges`` maps metric name -> value for point-in-time values
+    (pool usage, cache sizes, ...).
+    """
+    lines = []
+    with _lock:
+        lines += ["# HELP http_requests_total HTTP requests by route and status.",
+                  "# TYPE http_requests_total counter"]
+        for (method, route, status), count in sorted(_requests.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        lines += ["# HELP http_request_duration_seconds HTTP request latency by route.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), histogram in sorted(_latency.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+            lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le='+Inf')} {histogram[-2]}")
+            lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {histogram[-1]:.6f}")
+            lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} {histogram[-2]}")
+
+        lines += ["# HELP http_request_db_calls_total Mongo commands issued by requests, by route.",
+                  "# TYPE http_request_db_calls_total counter"]
+        for (method, route), (calls, _) in sorted(_route_db.items()):
+            lines.append(f"http_request_db_calls_total{_labels(method=method, route=route)} {calls}")
+        lines += ["# HELP http_request_db_seconds_total Time spent in Mongo commands by requests, by route.",
+                  "# TYPE http_request_db_seconds_total counter"]
+        for (method, route), (_, seconds) in sorted(_route_db.items()):
+            lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {seconds:.6f}")
+
+        lines += ["# HELP mongo_commands_total Mongo commands by name.",
+                  "# TYPE mongo_commands_total counter"]
+        for name, (count, _, _) in sorted(_commands.items()):
+            lines.append(f"mongo_commands_total{_labels(command=name)} {count}")
+        lines += ["# HELP mongo_command_failures_total Failed Mongo commands by name.",
+                  "# TYPE mongo_command_failures_total counter"]
+        for name, (_, failures, _) in sorted(_commands.items()):
+            lines.append(f"mongo_command_failures_total{_labels(command=name)} {failures}")
+        lines += ["# HELP mongo_command_seconds_total Time spent in Mongo commands by name.",
+                  "# TYPE mongo_command_seconds_total counter"]
+        for name, (_, _, seconds) in sorted(_commands.items()):
+            lines.append(f"mongo_command_seconds_total{_labels(command=name)} {seconds:.6f}")
+
+    for name, value in (extra_gauges or {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+from time import monotonic
+from bson import ObjectId
+from db import db
+
+# Appointment statuses that keep their slot taken (cancelled ones free it)
+OCCUPYING_STATUSES = ("pending", "completed")
+# Set on appointments in an occupying status and unset when they are cancelled:
+# the unique slot indexes filter on it (a $in partial filter needs MongoDB 6.0)
+ACTIVE_FIELD = "active"
+
+
+def blocked_bitmap(blocks: dict) -> int:
+    """Bitmap of the minutes taken up by ``blocks`` (start minute -> length in minutes)."""
+    bitmap = 0
+    for start, minutes in blocks.items():
+        bitmap |= ((1 << minutes) - 1) << start
+    return bitmap
+
+
+class OccupancyIndex:
+    """In-process slot occupancy per (doctor, date), as time intervals.
+
+    A day keeps the start minute and length of each booked appointment; its
+    bitmap has bit ``m`` set for every minute ``m`` one of them takes up, so a
+    slot is free only when none of its minutes are, whatever grid the existing
+    appointments were booked on. A day also remembers the last slot each
+    session's queue counter numbered (see ``utils.counters``): freed slots before
+    it are not handed out again. Days are warmed lazily from the ``appointment``
+    collection and re-read after ``ttl`` seconds so bookings made by other
+    workers show up.
+    """
+
+    def __init__(self, minute_index: dict, default_minutes: int, ttl: float = 300):
+        self._minute_index = minute_index  # "HH:MM:SS" -> minute of the day (bit position)
+        # length of appointments stored without one (booked before lengths were recorded)
+        self._default_minutes = default_minutes
+        self._ttl = ttl
+        # (doctor_id, "YYYY-MM-DD") -> [{start minute: minutes}, loaded_at, bitmap or None, {session: last numbered minute}]
+        self._days = {}
+        self._pruned_on = None
+
+    def _fresh(self, key, now) -> bool:
+        entry = self._days.get(key)
+        return entry is not None and now - entry[1] < self._ttl
+
+    async def warm(self, doctor_id, first_date: date, last_date: date):
+        """Load the days of [first_date, last_date] that are missing or stale, in one query."""
+        self.prune(date.today())
+        doctor_key = str(doctor_id)
+        now = monotonic()
+        missing = {}
+        day = first_date
+        while day <= last_date:
+            if not self._fresh((doctor_key, day.isoformat()), now):
+                missing[day.isoformat()] = {}
+            day += timedelta(days=1)
+        if not missing:
+            return
+
+        cursor = db.appointment.find(
+            {
+                "doctor_id": ObjectId(doctor_key),
+                "date": {"$gte": min(missing), "$lte": max(missing)},
+                "status": {"$in": list(OCCUPYING_STATUSES)},
+            },
+            {"_id": 0, "date": 1, "time": 1, "slot_minutes": 1},
+        )
+        async for a in cursor:
+            start = self._minute_index.get(a["time"])
+            if a["date"] in missing and start is not None:
+                missing[a["date"]][start] = a.get("slot_minutes") or self._default_minutes
+
+        for day_iso, blocks in missing.items():
+            self._days[(doctor_key, day_iso)] = [blocks, now, None, {}]
+
+    def forget(self, doctor_id):
+        """Drop the doctor's loaded days so the next warm() reads them again."""
+        doctor_key = str(doctor_id)
+        for key in [k for k in self._days if k[0] == doctor_key]:
+            del self._days[key]
+
+    def blocked(self, doctor_id, day: date) -> int:
+        """Minutes of ``day`` taken up by the doctor's appointments, as a bitmap."""
+        entry = self._days.get((str(doctor_id), day.isoformat()))
+        if entry is None:
+            return 0
+        if entry[2] is None:
+            entry[2] = blocked_bitmap(entry[0])
+        return entry[2]
+
+    def numbered(self, doctor_id, day: date) -> dict:
+        """Session name -> minute of the last slot its queue counter numbered (as far as known here)."""
+        entry = self._days.get((str(doctor_id), day.isoformat()))
+        return entry[3] if entry is not None else {}
+
+    def mark_numbered(self, doctor_id, day: str, session: str, slot_time: str):
+        """Record that ``session`` numbered a slot at ``slot_time`` (only for days already loaded)."""
+        entry = self._days.get((str(doctor_id), day))
+        minute = self._minute_index.get(slot_time)
+        if entry is not None and minute is not None and session is not None:
+            entry[3][session] = max(minute, entry[3].get(session, minute))
+
+    def mark(self, doctor_id, day: str, slot_time: str, minutes: int = None):
+        """Record a booked slot (only for days already loaded)."""
+        entry = self._days.get((str(doctor_id), day))
+        start = self._minute_index.get(slot_time)
+        if entry is not None and start is not None:
+            entry[0][start] = minutes or self._default_minutes
+            entry[2] = None
+
+    def release(self, doctor_id, day: str, slot_time: str):
+        """Forget a freed slot (only for days already loaded)."""
+        entry = self._days.get((str(doctor_id), day))
+        start = self._minute_index.get(slot_time)
+        if entry is not None and entry[0].pop(start, None) is not None:
+            entry[2] = None
+
+    def apply(self, appointment: dict):
+        """Reflect an appointment document's current status in the index."""
+        if appointment.get("status") in OCCUPYING_STATUSES:
+            self.mark(appointment["doctor_id"], appointment["date"], appointment["time"], appointment.get("slot_minutes"))
+        else:
+            self.release(appointment["doctor_id"], appointment["date"], appointment["time"])
+
+    def prune(self, before: date):
+        """Drop days earlier than ``before`` (runs at most once per day)."""
+        if self._pruned_on == before:
+            return
+        cutoff = before.isoformat()
+        for key in [k for k in self._days if k[1] < cutoff]:
+            del self._days[key]
+        self._pruned_on = before
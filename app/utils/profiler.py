@@ -0,0 +1,301 @@
+"""Slow-query / slow-request profiler writing JSON lines to a rotating local file.
+
+Off unless ``PROFILE_ENABLED`` is set. Two kinds of records are written:
+
+* ``slow_query``: a Mongo command slower than ``PROFILE_SLOW_QUERY_MS``, with the
+  shape of its filter / pipeline (values replaced by ``"?"``) and the route of
+  the request that issued it.
+* ``slow_request``: a request slower than ``PROFILE_SLOW_REQUEST_MS``. With
+  ``PROFILE_SAMPLE_STACKS`` on, a sampler thread also captures the request's
+  stack every ``PROFILE_SAMPLE_INTERVAL_MS`` once it is over budget, and the
+  record carries the collapsed stacks with their sample counts. Streaming
+  responses (SSE feeds, NDJSON exports) stay open by design and are neither
+  sampled nor logged.
+
+    python -m utils.profiler profile.jsonl    # top slow query shapes / routes
+"""
+from collections import Counter
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pymongo import monitoring
+from time import perf_counter
+from utils.metrics import current_request, route_of
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SLOW_QUERY_MS = float(os.getenv("PROFILE_SLOW_QUERY_MS", "100"))
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "500"))
+PROFILE_SAMPLE_STACKS = os.getenv("PROFILE_SAMPLE_STACKS", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "20"))
+PROFILE_LOG_FILE = os.getenv("PROFILE_LOG_FILE", "profile.jsonl")
+PROFILE_LOG_MAX_BYTES = int(os.getenv("PROFILE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+PROFILE_LOG_BACKUPS = int(os.getenv("PROFILE_LOG_BACKUPS", "5"))
+MAX_STACK_DEPTH = 40
+# responses that stay open for as long as the client reads them
+STREAMING_MEDIA_TYPES = (b"text/event-stream", b"application/x-ndjson")
+
+# Where each command keeps the part worth profiling
+_SHAPE_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort", "update"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+
+_log = None
+
+
+def _logger() -> logging.Logger:
+    global _log
+    if _log is None:
+        log = logging.getLogger("hospital.profile")
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        directory = os.path.dirname(PROFILE_LOG_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(PROFILE_LOG_FILE, maxBytes=PROFILE_LOG_MAX_BYTES,
+                                      backupCount=PROFILE_LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        _log = log
+    return _log
+
+
+def _write(record: dict):
+    record["ts"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    try:
+        _logger().info(json.dumps(record, default=str))
+    except Exception as e:
+        print(f"❌ Error writing profile record: {e}")
+
+
+def query_shape(value):
+    """``value`` with every literal replaced by ``"?"``; keys and operators are kept."""
+    if isinstance(value, Mapping):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Logs commands over ``PROFILE_SLOW_QUERY_MS`` with their shape and the issuing route."""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+        self._started = {}  # (connection, request id) -> (collection, shape, route, request id)
+
+    def started(self, event):
+        command = event.command
+        collection = command.get(event.command_name)
+        shape = {field: query_shape(command[field])
+                 for field in _SHAPE_FIELDS.get(event.command_name, ()) if field in command}
+        stats = current_request.get()
+        origin = (route_of(stats.scope), stats.request_id) if stats is not None and stats.scope else (None, None)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else None, shape, *origin)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        ms = event.duration_micros / 1000
+        if started is None or ms < self.threshold_ms:
+            return
+        collection, shape, route, request_id = started
+        _write({"type": "slow_query", "command": event.command_name, "collection": collection,
+                "ms": round(ms, 3), "failed": failed, "shape": shape,
+                "route": route, "request_id": request_id})
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class _InFlight:
+    __slots__ = ("task", "started", "samples")
+
+    def __init__(self, task):
+        self.task = task
+        self.started = perf_counter()
+        self.samples = Counter()  # collapsed stack -> samples
+
+
+def _collapse(frames) -> str:
+    return ";".join(f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}:{f.f_lineno}" for f in frames)
+
+
+def _await_chain(coro) -> list:
+    """Frames of a suspended coroutine and everything it is awaiting, outermost first."""
+    frames = []
+    while coro is not None and len(frames) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def _thread_frames(frame) -> list:
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of in-flight requests that are over their latency budget.
+
+    For a request that is awaiting, the sample is its coroutine chain (where it is
+    waiting). When the request's own code is running on the event loop at the
+    moment of the sample, the loop thread's stack is taken instead, so blocking
+    work shows up with its real call path.
+    """
+
+    def __init__(self, budget_ms: float, interval_ms: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.budget = budget_ms / 1000
+        self.interval = interval_ms / 1000
+        self.loop_thread_id = threading.get_ident()
+        self.inflight = {}  # id(task) -> _InFlight
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            now = perf_counter()
+            for request in list(self.inflight.values()):
+                if now - request.started >= self.budget:
+                    try:
+                        request.samples[self._sample(request.task)] += 1
+                    except Exception:
+                        pass
+
+    def _sample(self, task) -> str:
+        coro = task.get_coro()
+        if getattr(coro, "cr_running", False):
+            frame = sys._current_frames().get(self.loop_thread_id)
+            return "loop;" + _collapse(_thread_frames(frame))
+        return "await;" + _collapse(_await_chain(coro))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_sampler = None
+
+
+class RequestProfiler:
+    """ASGI middleware logging requests over ``PROFILE_SLOW_REQUEST_MS``.
+
+    Must sit inside the metrics middleware, so that it runs in the same task as
+    the endpoint and sees the request id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_ENABLED:
+            return await self.app(scope, receive, send)
+
+        sampler = _sampler
+        task = asyncio.current_task()
+        inflight = _InFlight(task)
+        if sampler is not None:
+            sampler.inflight[id(task)] = inflight
+        status = 500
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                streaming = content_type.split(b";")[0].strip() in STREAMING_MEDIA_TYPES
+            elif message["type"] == "http.response.body" and message.get("more_body"):
+                # a body sent in chunks (StreamingResponse): its duration is the client's, not ours
+                streaming = True
+            if streaming and sampler is not None:
+                sampler.inflight.pop(id(task), None)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if sampler is not None:
+                sampler.inflight.pop(id(task), None)
+            ms = (perf_counter() - inflight.started) * 1000
+            if ms >= PROFILE_SLOW_REQUEST_MS and not streaming:
+                stats = current_request.get()
+                record = {"type": "slow_request", "method": scope["method"], "route": route_of(scope),
+                          "path": scope["path"], "status": status, "ms": round(ms, 3),
+                          "request_id": stats.request_id if stats else None,
+                          "db_calls": stats.db_calls if stats else None}
+                if inflight.samples:
+                    record["stacks"] = dict(inflight.samples.most_common())
+                _write(record)
+
+
+slow_query_profiler = SlowQueryProfiler(PROFILE_SLOW_QUERY_MS)
+
+
+def start_profiler():
+    """Start the stack sampler (from the event loop thread); no-op unless enabled."""
+    global _sampler
+    if PROFILE_ENABLED and PROFILE_SAMPLE_STACKS and _sampler is None:
+        _sampler = StackSampler(PROFILE_SLOW_REQUEST_MS, PROFILE_SAMPLE_INTERVAL_MS)
+        _sampler.start()
+
+
+def stop_profiler():
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
+def summarize(path: str, top: int = 10):
+    """Print the slowest query shapes and routes found in a profile file."""
+    queries, requests = {}, {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "slow_query":
+                key = (record["command"], record["collection"], json.dumps(record["shape"], sort_keys=True))
+                bucket = queries
+            else:
+                key = (record["method"], record["route"])
+                bucket = requests
+            entry = bucket.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += record["ms"]
+            entry[2] = max(entry[2], record["ms"])
+
+    for title, bucket in (("slow queries", queries), ("slow requests", requests)):
+        print(f"{title}: count / total ms / max ms")
+        for key, (count, total, worst) in sorted(bucket.items(), key=lambda kv: -kv[1][1])[:top]:
+            print(f"  {count:>6} {total:>10.1f} {worst:>9.1f}  {' '.join(str(k) for k in key)}")
+
+
+if __name__ == "__main__":
+    summarize(sys.argv[1] if len(sys.argv) > 1 else PROFILE_LOG_FILE)
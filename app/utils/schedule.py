@@ -0,0 +1,155 @@
+"""Per-doctor schedule templates, compiled into weekly slot grids.
+
+A template lives in the ``doctor_schedule`` collection (``_id`` = doctor id)::
+
+    {"slot_minutes": 20,
+     "weekly": [[{"name": "morning", "start": "09:00", "end": "12:00"}, ...],  # Monday
+                ..., []],                                                       # Sunday
+     "exceptions": {"2026-12-24": [], "2026-12-31": [{"name": "morning", ...}]}}
+
+An exception replaces the weekly sessions of one date (an empty list is a day
+off). Doctors without a template follow ``DEFAULT_TEMPLATE``, the original fixed
+hours.
+
+A compiled day is a bitmap over the minutes of the day: bit ``m`` is set when a
+slot starts at minute ``m``. The occupancy index uses the same bit positions for
+the minutes booked appointments take up, so finding a free slot is a couple of
+integer operations, even when the grid changed after the appointments were made.
+"""
+from datetime import date, time
+from typing import Optional
+from bson import ObjectId
+import os
+from db import db
+from utils.cache import TTLCache
+
+MINUTES_PER_DAY = 24 * 60
+# stored "HH:MM:SS" slot time -> bit position
+MINUTE_INDEX = {f"{m // 60:02d}:{m % 60:02d}:00": m for m in range(MINUTES_PER_DAY)}
+
+# --- Default hours (the original global schedule) ---
+MORNING_START = time(9, 0)
+MORNING_END = time(12, 0)
+AFTERNOON_START = time(15, 0)
+AFTERNOON_END = time(18, 0)
+DEFAULT_SLOT_MINUTES = 20
+
+
+def _hhmm(t: time) -> str:
+    return t.strftime("%H:%M")
+
+
+_MORNING = {"name": "morning", "start": _hhmm(MORNING_START), "end": _hhmm(MORNING_END)}
+_AFTERNOON = {"name": "afternoon", "start": _hhmm(AFTERNOON_START), "end": _hhmm(AFTERNOON_END)}
+# Monday..Friday both sessions, Saturday mornings only, Sunday off
+DEFAULT_TEMPLATE = {
+    "slot_minutes": DEFAULT_SLOT_MINUTES,
+    "weekly": [[_MORNING, _AFTERNOON]] * 5 + [[_MORNING], []],
+    "exceptions": {},
+}
+
+
+def time_minute(t: time) -> int:
+    """Minute of the day of ``t``, rounded up to the next whole minute."""
+    return t.hour * 60 + t.minute + (1 if t.second or t.microsecond else 0)
+
+
+def minute_time(minute: int) -> time:
+    return time(minute // 60, minute % 60)
+
+
+def _parse_minute(hhmm: str) -> int:
+    hour, minute = hhmm.split(":")[:2]
+    return int(hour) * 60 + int(minute)
+
+
+class DayGrid:
+    """Bookable slots of one day: ``mask`` plus the part of it each session owns."""
+
+    __slots__ = ("mask", "sessions")
+
+    def __init__(self, sessions: tuple):
+        self.sessions = sessions  # ((name, mask), ...) in day order
+        self.mask = 0
+        for _, mask in sessions:
+            self.mask |= mask
+
+    def session_of(self, minute: int) -> Optional[str]:
+        for name, mask in self.sessions:
+            if mask >> minute & 1:
+                return name
+        return None
+
+
+class ScheduleGrid:
+    """A doctor's compiled schedule: one DayGrid per weekday plus dated exceptions."""
+
+    __slots__ = ("weekly", "exceptions", "slot_minutes")
+
+    def __init__(self, weekly: tuple, exceptions: dict, slot_minutes: int):
+        self.weekly = weekly
+        self.exceptions = exceptions  # "YYYY-MM-DD" -> DayGrid
+        self.slot_minutes = slot_minutes
+
+    def day(self, d: date) -> DayGrid:
+        grid = self.exceptions.get(d.isoformat())
+        return grid if grid is not None else self.weekly[d.weekday()]
+
+
+def validate_sessions(sessions: list, slot_minutes: int):
+    """Raise ValueError unless the sessions of a day are well-formed and do not overlap."""
+    previous_end, names = -1, set()
+    for session in sorted(sessions, key=lambda s: _parse_minute(s["start"])):
+        start, end = _parse_minute(session["start"]), _parse_minute(session["end"])
+        if end - start < slot_minutes:
+            raise ValueError(f"Session {session['name']} is shorter than one slot")
+        if start < previous_end:
+            raise ValueError(f"Session {session['name']} overlaps the previous one")
+        if session["name"] in names:
+            raise ValueError(f"Session {session['name']} appears twice on the same day")
+        previous_end = end
+        names.add(session["name"])
+
+
+def compile_day(sessions: list, slot_minutes: int) -> DayGrid:
+    compiled = []
+    for session in sorted(sessions, key=lambda s: _parse_minute(s["start"])):
+        start, end = _parse_minute(session["start"]), _parse_minute(session["end"])
+        mask = 0
+        for minute in range(start, end - slot_minutes + 1, slot_minutes):
+            mask |= 1 << minute
+        compiled.append((session["name"], mask))
+    return DayGrid(tuple(compiled))
+
+
+def compile_template(template: dict, today: Optional[date] = None) -> ScheduleGrid:
+    """Compile a stored template; missing fields fall back to ``DEFAULT_TEMPLATE``."""
+    slot_minutes = template.get("slot_minutes") or DEFAULT_SLOT_MINUTES
+    weekly = template.get("weekly") or DEFAULT_TEMPLATE["weekly"]
+    cutoff = (today or date.today()).isoformat()
+    return ScheduleGrid(
+        tuple(compile_day(sessions, slot_minutes) for sessions in weekly),
+        {day: compile_day(sessions, slot_minutes)
+         for day, sessions in (template.get("exceptions") or {}).items() if day >= cutoff},
+        slot_minutes,
+    )
+
+
+DEFAULT_GRID = compile_template(DEFAULT_TEMPLATE)
+
+# Compiled grids per doctor; other workers see template edits after the TTL
+schedule_cache = TTLCache(maxsize=4096, ttl=float(os.getenv("SCHEDULE_TTL_SECONDS", "60")))
+
+
+async def doctor_schedule(doctor_id) -> ScheduleGrid:
+    key = str(doctor_id)
+    grid = schedule_cache.get(key)
+    if grid is None:
+        template = await db.doctor_schedule.find_one({"_id": ObjectId(key)})
+        grid = compile_template(template) if template else DEFAULT_GRID
+        schedule_cache.set(key, grid)
+    return grid
+
+
+def forget_schedule(doctor_id):
+    schedule_cache.pop(str(doctor_id))
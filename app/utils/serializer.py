@@ -0,0 +1,24 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj) -> bytes:
+    """Encode Mongo documents in one pass: ObjectId -> str, datetime -> ISO 8601."""
+    return orjson.dumps(obj, default=_default)
+
+
+class BSONResponse(JSONResponse):
+    """JSON response for raw Mongo documents, skipping FastAPI's jsonable_encoder.
+
+    Return it directly from a route (``return BSONResponse({...})``).
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -1,128 +1,178 @@
 from datetime import datetime, date, time, timedelta
+from typing import Optional
 from fastapi import HTTPException
 from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+import os
 from db import db
+from utils.occupancy import OccupancyIndex, OCCUPYING_STATUSES, ACTIVE_FIELD, blocked_bitmap
+from utils.cache import TTLCache
+from utils.counters import next_qnum, numbered_until
+from utils.schedule import (
+    DEFAULT_GRID, DEFAULT_SLOT_MINUTES, MINUTE_INDEX, AFTERNOON_START, doctor_schedule, minute_time, time_minute,
+)
 
-# --- Config / constants (same as original) ---
-MORNING_START = time(9, 0)
-MORNING_END = time(12, 0)
-AFTERNOON_START = time(15, 0)
-AFTERNOON_END = time(18, 0)
-APPOINTMENT_DURATION = timedelta(minutes=20)
-
-
-# --- Utilities ---
-def next_working_day(current_date: date) -> date:
-    """Return the next non-Sunday date (same logic as original)."""
-    next_day = current_date + timedelta(days=1)
-    while next_day.weekday() == 6:  # Sunday (weekday() == 6)
-        next_day += timedelta(days=1)
-    return next_day
-
-
-def _round_up_to_next_slot(t: time) -> time:
-
-    # compute minute bucket
-    total_minutes = t.hour * 60 + t.minute
-    # Add 1 second margin so exact boundaries behave same as original rounding-up logic
-    # (original used integer division then +1)
-    # We'll compute next boundary:
-    remainder = total_minutes % 20
-    if remainder == 0:
-        next_total = total_minutes + 20
-    else:
-        next_total = total_minutes + (20 - remainder)
-    next_hour = next_total // 60
-    next_min = next_total % 60
-    # normalize hour to 0-23 (if it becomes 24+ we wrap to hour value >23 but
-    # callers will treat times outside sessions)
-    next_hour = next_hour % 24
-    return time(next_hour, next_min)
+# Slot times of a default weekday (the original fixed grid)
+SLOT_TIMES = [minute_time(m) for m in range(24 * 60) if DEFAULT_GRID.weekly[0].mask >> m & 1]
+
+# Occupancy bit positions are minutes of the day, the same as the schedule grids
+occupancy = OccupancyIndex(MINUTE_INDEX, DEFAULT_SLOT_MINUTES, ttl=float(os.getenv("OCCUPANCY_TTL_SECONDS", "300")))
 
 
 # --- Slot-finding (merged and simplified) ---
-async def find_next_free_slot(doctor_id, start_date: date, start_time: time):
+# Days of occupancy warmed per query; the window doubles each time the search outgrows it
+SLOT_WINDOW_DAYS = 7
+# safety limit to avoid searching forever
+MAX_SEARCH_DAYS = 60
 
-    candidate_date = start_date
-    candidate_time = start_time
-    increments = 0
 
-    # safety loop to avoid infinite loops
-    for _ in range(500):
-        # Snap candidate_time into the next valid session if it's outside sessions
-        if MORNING_START <= candidate_time < MORNING_END:
-            session_end = MORNING_END
-        elif AFTERNOON_START <= candidate_time < AFTERNOON_END:
-            session_end = AFTERNOON_END
-        else:
-            # Not in any session — move forward to nearest session start (preserve original snapping logic)
-            if candidate_time < MORNING_START:
-                candidate_time = MORNING_START
-            elif candidate_time < AFTERNOON_START:
-                candidate_time = AFTERNOON_START
-            else:
-                # after AFTERNOON_END -> next working day morning
-                candidate_date = next_working_day(candidate_date)
-                candidate_time = MORNING_START
-            # continue to re-evaluate with snapped time
-            continue
+def _lowest_bit(bitmap: int) -> int:
+    return (bitmap & -bitmap).bit_length() - 1
 
-        # If Saturday afternoon or later, move to next working day's morning
-        if candidate_date.weekday() == 5 and candidate_time >= AFTERNOON_START:
-            candidate_date = next_working_day(candidate_date)
-            candidate_time = MORNING_START
-            continue
 
-        # Check DB for occupancy
-        slot = await db.appointments.find_one({
-            "doctor_id": ObjectId(doctor_id),
-            "date": candidate_date.isoformat(),
-            "time": candidate_time.strftime("%H:%M:%S")
-        })
-        if not slot:
-            # free slot found
-            return candidate_date, candidate_time, increments
-
-        # otherwise move to next 20-minute slot
-        dt = datetime.combine(candidate_date, candidate_time) + APPOINTMENT_DURATION
-        candidate_date, candidate_time = dt.date(), dt.time()
-        increments += 1
+def clashing_starts(blocked: int, slot_minutes: int) -> int:
+    """Start minutes whose ``slot_minutes``-long slot overlaps a ``blocked`` minute.
+
+    Bit ``m`` is set when any of bits ``m .. m + slot_minutes - 1`` of ``blocked``
+    is (ORing the bitmap with itself shifted by 1, 2, 4, ... minutes).
+    """
+    clashing, width = blocked, 1
+    while width < slot_minutes:
+        shift = min(width, slot_minutes - width)
+        clashing |= clashing >> shift
+        width += shift
+    return clashing
+
+
+def numbered_slots(day_grid, numbered: dict) -> int:
+    """Slots of ``day_grid`` at or before the last one each session's queue counter numbered."""
+    closed = 0
+    for name, mask in day_grid.sessions:
+        if name in numbered:
+            closed |= mask & ((2 << numbered[name]) - 1)
+    return closed
+
+
+async def find_next_free_slot(doctor_id, start_date: date, start_time: time):
+    """First free slot of the doctor's schedule at or after ``start_date`` ``start_time``."""
+    grid = await doctor_schedule(doctor_id)
+    candidate_date = start_date
+    # slots start on whole minutes: ignore the ones before start_time
+    first_bit = time_minute(start_time)
+    increments = 0
+
+    window_days = SLOT_WINDOW_DAYS
+    window_end = start_date + timedelta(days=window_days - 1)
+    await occupancy.warm(doctor_id, start_date, window_end)
+
+    for _ in range(MAX_SEARCH_DAYS):
+        # Walked past the warmed window -> warm the next (larger) one
+        while candidate_date > window_end:
+            window_start = window_end + timedelta(days=1)
+            window_days *= 2
+            window_end = window_start + timedelta(days=window_days - 1)
+            await occupancy.warm(doctor_id, window_start, window_end)
+
+        day_grid = grid.day(candidate_date)
+        allowed = day_grid.mask & ~((1 << first_bit) - 1)
+        # queue numbers follow slot order: slots before a session's last numbered one stay closed
+        taken = (clashing_starts(occupancy.blocked(doctor_id, candidate_date), grid.slot_minutes)
+                 | numbered_slots(day_grid, occupancy.numbered(doctor_id, candidate_date))) & allowed
+        free = allowed & ~taken
+        if free:
+            # lowest free bit; every taken slot before it counts as an increment
+            bit = _lowest_bit(free)
+            increments += (taken & ((1 << bit) - 1)).bit_count()
+            return candidate_date, minute_time(bit), increments
+
+        increments += taken.bit_count()
+        candidate_date += timedelta(days=1)
+        first_bit = 0
 
     # if we exit loop, we couldn't find a slot
     raise HTTPException(status_code=500, detail="Unable to find free slot (too many attempts).")
 
 
-def get_next_slot_time(current_time: time) -> time:
+# --- Availability calendar ---
+# Short-lived so a busy booking screen shares one aggregation per doctor
+availability_cache = TTLCache(maxsize=1024, ttl=float(os.getenv("AVAILABILITY_TTL_SECONDS", "5")))
 
-    # before morning -> start of morning
-    if current_time < MORNING_START:
-        return MORNING_START
 
-    # in morning session
-    if MORNING_START <= current_time < MORNING_END:
-        candidate = _round_up_to_next_slot(current_time)
-        return candidate if candidate < MORNING_END else AFTERNOON_START
+def _slot_labels(bitmap: int) -> list:
+    labels = []
+    while bitmap:
+        labels.append(minute_time(_lowest_bit(bitmap)).strftime("%H:%M:%S"))
+        bitmap &= bitmap - 1
+    return labels
 
-    # in afternoon session
-    if AFTERNOON_START <= current_time < AFTERNOON_END:
-        candidate = _round_up_to_next_slot(current_time)
-        return candidate if candidate < AFTERNOON_END else MORNING_START
 
-    # fallback (e.g. between MORNING_END and AFTERNOON_START or after AFTERNOON_END)
-    return MORNING_START
+async def doctor_availability(doctor_id, days: int) -> list:
+    """Free slots per day and session for the next ``days`` days (today included).
 
+    Occupancy comes from one aggregation (plus the doctor and schedule lookups); each day's free slots
+    are the doctor's grid for that date minus the starts that clash with booked minutes.
+    """
+    now = datetime.now()
+    key = (str(doctor_id), days, now.date())
+    cached = availability_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if not await db.doctor.find_one({"_id": ObjectId(doctor_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    grid = await doctor_schedule(doctor_id)
+
+    last_date = now.date() + timedelta(days=days - 1)
+    taken = {}
+    pipeline = [
+        {"$match": {
+            "doctor_id": ObjectId(doctor_id),
+            "date": {"$gte": now.date().isoformat(), "$lte": last_date.isoformat()},
+            "status": {"$in": list(OCCUPYING_STATUSES)},
+        }},
+        {"$group": {"_id": "$date", "slots": {"$push": {"time": "$time", "minutes": "$slot_minutes"}}}},
+    ]
+    async for day in db.appointment.aggregate(pipeline):
+        blocks = {MINUTE_INDEX[s["time"]]: s.get("minutes") or DEFAULT_SLOT_MINUTES
+                  for s in day["slots"] if s["time"] in MINUTE_INDEX}
+        taken[day["_id"]] = clashing_starts(blocked_bitmap(blocks), grid.slot_minutes)
+
+    calendar = []
+    for offset in range(days):
+        day = now.date() + timedelta(days=offset)
+        day_grid = grid.day(day)
+        allowed = day_grid.mask
+        if not allowed:
+            continue
+        if offset == 0:
+            # slots that already started today are gone
+            allowed &= ~((1 << (now.hour * 60 + now.minute + 1)) - 1)
+        free = allowed & ~taken.get(day.isoformat(), 0)
+        entry = {"date": day.isoformat()}
+        for name, mask in day_grid.sessions:
+            entry[name] = _slot_labels(free & mask)
+        calendar.append(entry)
 
-async def get_first_available_slot(doctor_id, current_time: time):
+    availability_cache.set(key, calendar)
+    return calendar
 
-    now_date = datetime.now().date()
 
-    if now_date.weekday() == 6:
-        now_date = next_working_day(now_date)
+def get_next_slot_time(day_grid, current_time: time) -> Optional[time]:
+    """First slot of ``day_grid`` starting after ``current_time``; None when the day is over."""
+    later = day_grid.mask & ~((1 << (current_time.hour * 60 + current_time.minute + 1)) - 1)
+    return minute_time(_lowest_bit(later)) if later else None
 
-    now_time = get_next_slot_time(current_time)
 
-    if now_time == MORNING_START and current_time >= AFTERNOON_END:
-        now_date = next_working_day(now_date)
+async def get_first_available_slot(doctor_id, current_time: time):
+
+    now_date = datetime.now().date()
+    grid = await doctor_schedule(doctor_id)
+
+    now_time = get_next_slot_time(grid.day(now_date), current_time)
+    if now_time is None:
+        # nothing left today -> search from tomorrow's first slot
+        now_date, now_time = now_date + timedelta(days=1), time(0, 0)
 
     appointment_date, appointment_time, increments = await find_next_free_slot(
         doctor_id, now_date, now_time
@@ -132,105 +182,101 @@ async def get_first_available_slot(doctor_id, current_time: time):
     return appointment_date, appointment_time, 1 + increments
 
 
-def get_session(t: time):
-    """Return 'morning' or 'afternoon' depending on time, otherwise None."""
-    if MORNING_START <= t < MORNING_END:
-        return "morning"
-    if AFTERNOON_START <= t < AFTERNOON_END:
-        return "afternoon"
-    return None
+async def get_session(doctor_id, day: date, t: time) -> Optional[str]:
+    """Name of the doctor's session containing the slot at ``day`` ``t``, otherwise None."""
+    grid = await doctor_schedule(doctor_id)
+    return grid.day(day).session_of(time_minute(t))
 
 
-async def book_slot(last_appointment, doctor_id, patient_id):
-    now = datetime.now()
-    today = now.date()
-
-    #     # Prevent same-day double booking for patient
-
-    last_date = None
-    last_time = None
-    last_qnum = 0
-    last_session = None
-
-    if last_appointment:
-        last_date = datetime.fromisoformat(last_appointment["date"]).date()
-        last_time = datetime.strptime(last_appointment["time"], "%H:%M:%S").time()
-        last_qnum = int(last_appointment.get("qnumber", 0))
-        last_session = get_session(last_time)
-
-    # CASE A: No previous appointment
-    if not last_appointment:
-        appointment_date, appointment_time, qnumber = await get_first_available_slot(doctor_id, now.time())
-
-    # CASE B: Doctor has previous appointments
-    else:
-        proposed_dt = datetime.combine(last_date, last_time) + APPOINTMENT_DURATION
-        candidate_date, candidate_time = proposed_dt.date(), proposed_dt.time()
-
-        if last_date >= today:
-            appointment_date, appointment_time, increments = await find_next_free_slot(
-                doctor_id, candidate_date, candidate_time
-            )
-
-            # Determine session of the newly found appointment
-            new_session = get_session(appointment_time)
-
-            # If same day AND same session as last appointment, continue numbering from last_qnum
-            if appointment_date == last_date and last_session and new_session and last_session == new_session:
-                qnumber = last_qnum + 1 + increments
-            else:
-                # Different session or different day -> session numbering resets
-                qnumber = 1 + increments
-        else:
-            appointment_date, appointment_time, qnumber = await get_first_available_slot(doctor_id, now.time())
-
-    # Ensure final appointment is strictly in the future
-    final_dt = datetime.combine(appointment_date, appointment_time)
-    if final_dt <= now:
-        appointment_date = next_working_day(now.date())
-        appointment_time = MORNING_START
-        appointment_date, appointment_time, inc = await find_next_free_slot(
-            doctor_id, appointment_date, appointment_time
-        )
-        qnumber = 1 + inc
-
-    # Prevent same-day double booking for patient
-    if await db.appointments.find_one({
-        "patient_id": patient_id,
-        "date": appointment_date.isoformat()
-    }):
-        raise HTTPException(status_code=400, detail="You already have an appointment on this day.")
-
-    # Defensive re-check: if intended slot is taken, advance to next free slot and update qnumber accordingly
-    if await db.appointments.find_one({
-        "doctor_id": ObjectId(doctor_id),
-        "date": appointment_date.isoformat(),
-        "time": appointment_time.strftime("%H:%M:%S")
-    }):
-        # search starting at next slot
-        next_start_time = (datetime.combine(appointment_date, appointment_time) + APPOINTMENT_DURATION).time()
-        appointment_date, appointment_time, inc = await find_next_free_slot(
-            doctor_id,
-            appointment_date,
-            next_start_time
-        )
-
-        # Decide base for qnumber when we advance:
-        # If we have a last appointment on the same date and the new slot is in the same session -> continue numbering,
-        # otherwise start session numbering from 1.
-        new_session = get_session(appointment_time)
-        if last_appointment and appointment_date == last_date and last_session and new_session and last_session == new_session:
-            base = last_qnum
-        else:
-            base = 0
-
-        qnumber = base + 1 + inc
-
-
-    if await db.appointment.find_one({
-        "patient_id": patient_id,
-        "date": appointment_date.isoformat()
-    }):
-        raise HTTPException(status_code=400, detail="You already have an appointment on this day.")
-
-    return appointment_date, appointment_time, qnumber
\ No newline at end of file
+async def skip_numbered(doctor_id, day: str, session: str):
+    """Learn how far ``session``'s queue counter has numbered so the slot search starts after it."""
+    last_time = await numbered_until(doctor_id, day, session)
+    if last_time:
+        occupancy.mark_numbered(doctor_id, day, session, last_time)
+
+
+async def book_slot(doctor_id):
+    """Return the (date, time) of the doctor's first free slot that starts after now."""
+    appointment_date, appointment_time, _ = await get_first_available_slot(doctor_id, datetime.now().time())
+    return appointment_date, appointment_time
+
+
+def session_expression(field: str = "$time") -> dict:
+    """Mongo expression for an appointment's session: the stored one, else the default grid's split."""
+    default = {"$cond": [{"$lt": [field, AFTERNOON_START.strftime("%H:%M:%S")]}, "morning", "afternoon"]}
+    return {"$ifNull": ["$session", default]}
+
+
+def appointment_session(appointment: dict) -> str:
+    """Python twin of session_expression() for an appointment document."""
+    if appointment.get("session"):
+        return appointment["session"]
+    return "morning" if appointment["time"] < AFTERNOON_START.strftime("%H:%M:%S") else "afternoon"
+
+
+# --- Atomic reservation ---
+# The insert itself is the reservation: these unique indexes reject a second
+# active appointment in the same doctor slot, or for the same patient on a day.
+SLOT_INDEXES = [
+    IndexModel(
+        [("doctor_id", 1), ("date", 1), ("time", 1)],
+        name="doctor_slot_unique",
+        unique=True,
+        partialFilterExpression={ACTIVE_FIELD: True},
+    ),
+    IndexModel(
+        [("patient_id", 1), ("date", 1)],
+        name="patient_day_unique",
+        unique=True,
+        partialFilterExpression={ACTIVE_FIELD: True},
+    ),
+]
+MAX_RESERVE_ATTEMPTS = 10
+
+
+async def mark_active_appointments() -> int:
+    """Set the active flag on occupying appointments stored without it (before it existed)."""
+    result = await db.appointment.update_many(
+        {"status": {"$in": list(OCCUPYING_STATUSES)}, ACTIVE_FIELD: {"$exists": False}},
+        {"$set": {ACTIVE_FIELD: True}},
+    )
+    return result.modified_count
+
+
+async def reserve_slot(doctor_id, doc: dict):
+    """Insert ``doc`` into the next free slot, moving on to the following slot when a
+    concurrent booking wins the unique index. Fills date/time/session/qnum/slot_minutes into ``doc``."""
+    appointment_date, appointment_time = await book_slot(doctor_id)
+    # the slot length is stored so occupancy keeps blocking it if the doctor's grid changes
+    doc["slot_minutes"] = (await doctor_schedule(doctor_id)).slot_minutes
+
+    for _ in range(MAX_RESERVE_ATTEMPTS):
+        doc["date"] = appointment_date.isoformat()
+        doc["time"] = appointment_time.strftime("%H:%M:%S")
+        doc["session"] = await get_session(doctor_id, appointment_date, appointment_time)
+        after = datetime.combine(appointment_date, appointment_time) + timedelta(seconds=1)
+        # a number is drawn per attempt: one drawn for a lost slot leaves a gap, never a repeat
+        doc["qnum"] = await next_qnum(doctor_id, doc["date"], doc["session"], doc["time"])
+        if doc["qnum"] is None:
+            # the session already numbered a later slot (this one was freed) -> book after it
+            await skip_numbered(doctor_id, doc["date"], doc["session"])
+            appointment_date, appointment_time, _ = await find_next_free_slot(doctor_id, after.date(), after.time())
+            continue
+        occupancy.mark_numbered(doctor_id, doc["date"], doc["session"], doc["time"])
+
+        try:
+            await db.appointment.insert_one(doc)
+        except DuplicateKeyError as e:
+            doc.pop("_id", None)
+            if "patient_id" in (e.details or {}).get("keyPattern", {}):
+                raise HTTPException(status_code=400, detail="You already have an appointment on this day.")
+
+            # slot was taken by another request/worker -> remember it and take the next one
+            occupancy.mark(doctor_id, doc["date"], doc["time"], doc["slot_minutes"])
+            appointment_date, appointment_time, _ = await find_next_free_slot(doctor_id, after.date(), after.time())
+            continue
+
+        occupancy.apply(doc)
+        return appointment_date, appointment_time, doc["qnum"]
+
+    raise HTTPException(status_code=409, detail="Unable to reserve a slot, please try again.")
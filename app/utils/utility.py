@@ -1,14 +1,42 @@
-from passlib.context import CryptContext
 from typing import Optional
-from jose import jwt # type: ignore
+from functools import lru_cache
 from datetime import timedelta,datetime
 import os
 from fastapi import Depends, HTTPException
 from fastapi.security import  HTTPBearer, HTTPAuthorizationCredentials
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+from bson import ObjectId
+from db import db
+from utils.cache import TTLCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost; hashes made with any other cost are rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 auth_scheme = HTTPBearer()
 
+# bcrypt releases the GIL, so a small bounded pool hashes off the event loop in parallel
+_hash_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HASH_WORKERS", "4")), thread_name_prefix="bcrypt")
+
+
+# passlib/bcrypt and jose are imported on first use, keeping them out of worker startup
+@lru_cache(maxsize=None)
+def pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
+
+
+@lru_cache(maxsize=None)
+def _jwt():
+    from jose import jwt # type: ignore
+    return jwt
+
 
 def hash_password(password: str) -> str:
     if not password:
@@ -17,36 +45,151 @@ def hash_password(password: str) -> str:
         raise ValueError("Password must be a string")
 
     password = password[:72]
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def verify_password(plain_password,hashed_password):
-    return pwd_context.verify(plain_password,hashed_password)
+    return pwd_context().verify(plain_password,hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, pwd_context().verify_and_update, plain_password, hashed_password)
+
+async def verify_login_password(collection, user: dict, plain_password: str) -> bool:
+    """Check a login password and store a fresh hash if the old one is outdated."""
+    valid, new_hash = await verify_password_async(plain_password, user["password"])
+    if valid and new_hash:
+        await collection.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+    return valid
+
+# --- JWT ---
+_jwt_settings = None
+
+# Verified tokens -> claims; an entry never outlives the token's own exp
+_token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+)
+
+
+def load_jwt_settings(settings=None) -> dict:
+    """Take the JWT settings from the app's ``config.Settings`` (or the environment) once."""
+    global _jwt_settings
+    if settings is not None:
+        _jwt_settings = {
+            "secret_key": settings.secret_key,
+            "algorithm": settings.algorithm,
+            "expire_minutes": settings.access_token_expire_minutes,
+        }
+    else:
+        _jwt_settings = {
+            "secret_key": os.getenv("SECRET_KEY"),
+            "algorithm": os.getenv("ALGORITHM"),
+            "expire_minutes": int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")),
+        }
+    return _jwt_settings
+
+
+def jwt_settings() -> dict:
+    return _jwt_settings or load_jwt_settings()
+
+
+def token_cache_stats() -> dict:
+    return _token_cache.stats()
+
 
 def create_access_token(data:dict,expires_delta:Optional[timedelta] = None):
     try:
+        settings = jwt_settings()
         to_encode = data.copy()
-        ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-        expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+        expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings["expire_minutes"]))
         to_encode.update({"exp":expire})
-        return jwt.encode(to_encode,os.getenv("SECRET_KEY"),algorithm=os.getenv("ALGORITHM"))
+        return _jwt().encode(to_encode,settings["secret_key"],algorithm=settings["algorithm"])
     except Exception as e:
         return str(e)
 
 def decode_access_token(token:str):
     try:
-        return jwt.decode(token,os.getenv("SECRET_KEY"),algorithm=os.getenv("ALGORITHM"))
+        settings = jwt_settings()
+        return _jwt().decode(token,settings["secret_key"],algorithms=settings["algorithm"])
     except Exception as e:
         return None
     
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+    # async so it runs on the event loop: _token_cache is not thread-safe (and an HS256 decode is cheap)
     token = credentials.credentials
+    user = _token_cache.get(token)
+    if user is not None:
+        return dict(user)
     try:
-        payload = jwt.decode(token,os.getenv("SECRET_KEY"), algorithms=os.getenv("ALGORITHM"))
+        settings = jwt_settings()
+        payload = _jwt().decode(token,settings["secret_key"], algorithms=settings["algorithm"])
         email = payload.get("email")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-    return {"email": email}
+    user = {"email": email, "role": payload.get("role"), "id": payload.get("sub")}
+    exp = payload.get("exp")
+    _token_cache.set(token, user, ttl=exp - time.time() if exp else None)
+    return dict(user)
+
+
+# --- Principal (who is calling) ---
+# Each role's accounts live in the collection of the same name
+ROLE_COLLECTIONS = ("patient", "doctor", "staff")
+
+# Short-lived cache of account documents and of principals resolved for legacy tokens
+_principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "30")),
+)
+
+
+def access_token_claims(user: dict, role: str) -> dict:
+    """Claims identifying an account: email, role and user id (``sub``)."""
+    return {"email": user["email"], "role": role, "sub": str(user["_id"])}
+
+
+async def get_current_principal(current_user: dict = Depends(get_current_user)) -> dict:
+    """Resolve the caller as ``{"email", "role", "id"}`` from the verified claims.
+
+    Tokens issued before role/id claims existed fall back to probing the role
+    collections once; the result is cached for PRINCIPAL_CACHE_TTL seconds.
+    """
+    if current_user["role"] in ROLE_COLLECTIONS and current_user["id"]:
+        return {"email": current_user["email"], "role": current_user["role"], "id": ObjectId(current_user["id"])}
+
+    principal = _principal_cache.get(("email", current_user["email"]))
+    if principal:
+        return principal
+    for role in ROLE_COLLECTIONS:
+        user = await db[role].find_one({"email": current_user["email"]}, {"_id": 1})
+        if user:
+            principal = {"email": current_user["email"], "role": role, "id": user["_id"]}
+            _principal_cache.set(("email", current_user["email"]), principal)
+            return principal
+    raise HTTPException(status_code=401, detail="User not found")
+
+
+async def load_principal(principal: dict) -> Optional[dict]:
+    """Fetch the caller's account document (one query by id, briefly cached)."""
+    key = (principal["role"], principal["id"])
+    user = _principal_cache.get(key)
+    if user is None:
+        user = await db[principal["role"]].find_one({"_id": principal["id"]}, {"password": 0})
+        if user:
+            _principal_cache.set(key, user)
+    return user
+
+
+def forget_principal(role: str, user: dict):
+    """Drop a cached account, e.g. after it was deleted."""
+    _principal_cache.pop((role, user["_id"]))
+    _principal_cache.pop(("email", user.get("email")))
 
@@ -0,0 +1,327 @@
+"""Load test / benchmark for the Hospital Management API.
+
+Boots ``main.app`` in-process (httpx ASGI transport), seeds doctors, patients and
+appointments, then drives the login, booking, listing and cancel flows with
+concurrent clients. Every flow reports requests/sec, p50/p95/p99 latency and DB
+calls per request; the run is saved as JSON under ``bench/results/``.
+
+    python bench/run.py                               # in-memory backend (mongomock-motor)
+    python bench/run.py --mongo mongodb://localhost   # local mongod, throwaway database
+
+With --mongo the database (--db-name, which must start with ``hospital_bench``)
+is dropped before and after the run.
+
+The in-memory backend differs from MongoDB where bookings are concerned:
+mongomock ignores ``partialFilterExpression``, so the unique slot indexes
+also cover cancelled appointments (a freed slot cannot be booked again) and
+the app reports them, plus the optional-email indexes, as index drift at
+startup. Use --mongo for numbers that involve cancel / rebook behaviour.
+
+Compare runs by diffing the JSON files (each records the git commit).
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app"))
+
+# the bench drops its database, so it only runs against names with this prefix
+BENCH_DB_PREFIX = "hospital_bench"
+
+# calls issued to Mongo by the request running in the current task (getMore not included)
+_db_calls = contextvars.ContextVar("db_calls", default=None)
+
+
+def _count_call():
+    calls = _db_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+
+class _CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            _count_call()
+            return attr(*args, **kwargs)
+        return call
+
+
+class _CountingDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        if name == "command":
+            _count_call()
+            return self._database.command
+        return _CountingCollection(getattr(self._database, name))
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name])
+
+
+def _use_in_memory_backend(database_module):
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is not installed: pip install mongomock-motor, or pass --mongo URI")
+
+    class InMemoryClient(AsyncMongoMockClient):
+        # driver-only options (listeners, pool tuning) mean nothing in memory
+        def __init__(self, host=None, **kwargs):
+            super().__init__(host)
+
+        def close(self):
+            pass
+
+    database_module.AsyncIOMotorClient = InMemoryClient
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_flow(client, name: str, requests: list, concurrency: int) -> dict:
+    """Send ``requests`` ((method, url, kwargs) tuples) with ``concurrency`` workers."""
+    pending = list(reversed(requests))
+    latencies, db_calls, errors = [], [], 0
+
+    async def worker():
+        nonlocal errors
+        while pending:
+            method, url, kwargs = pending.pop()
+            calls = [0]
+            token = _db_calls.set(calls)
+            start = perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                ok = response.status_code < 400 and not isinstance(response.json(), str)
+            except Exception:
+                ok = False
+            latencies.append((perf_counter() - start) * 1000)
+            db_calls.append(calls[0])
+            _db_calls.reset(token)
+            errors += 0 if ok else 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "name": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p95": round(_percentile(latencies, 95), 2),
+            "p99": round(_percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+        "db_calls_per_request": round(sum(db_calls) / len(db_calls), 2) if db_calls else 0.0,
+    }
+    print(f"{name:<10} {result['requests']:>6} req {result['rps']:>9} req/s  "
+          f"p50 {result['latency_ms']['p50']:>8} ms  p95 {result['latency_ms']['p95']:>8} ms  "
+          f"p99 {result['latency_ms']['p99']:>8} ms  db/req {result['db_calls_per_request']:>5}  errors {errors}")
+    return result
+
+
+async def seed(raw_db, args, password_hash: str) -> dict:
+    """Insert doctors, patients, staff and a history of appointments straight into Mongo."""
+    from bson import ObjectId
+    from utils.slot import SLOT_TIMES, appointment_session
+    from utils.occupancy import ACTIVE_FIELD
+
+    rng = random.Random(args.seed)
+    doctors = [{"_id": ObjectId(), "name": f"Doctor {i}", "experience_years": rng.randint(1, 30),
+                "specialization": rng.choice(["cardiology", "general", "ortho", "pediatrics"]),
+                "mobile_no": "9000000000", "email": f"doctor{i}@bench.local",
+                "password": password_hash, "role": "doctor"} for i in range(args.doctors)]
+    patients = [{"_id": ObjectId(), "name": f"Patient {i}", "mobile_no": "9000000000",
+                 "email": f"patient{i}@bench.local", "password": password_hash,
+                 "medical_history": "none", "role": "patient"} for i in range(args.patients + args.requests)]
+    staff = {"_id": ObjectId(), "name": "Bench Staff", "mobile_no": "9000000000",
+             "email": "staff@bench.local", "password": password_hash}
+
+    # history for the first args.patients patients; the rest are kept free to book
+    appointments, doctor_slots, patient_days = [], set(), set()
+    today = date.today()
+    while len(appointments) < args.appointments:
+        doctor, patient = rng.choice(doctors), rng.choice(patients[:args.patients])
+        day = today + timedelta(days=rng.randint(-args.history_days, 14))
+        if day.weekday() == 6:
+            continue
+        slot = rng.choice(SLOT_TIMES)
+        key = (doctor["_id"], day, slot)
+        if key in doctor_slots or (patient["_id"], day) in patient_days:
+            continue
+        doctor_slots.add(key)
+        patient_days.add((patient["_id"], day))
+        status = "pending" if day >= today else rng.choice(["completed", "completed", "cancelled"])
+        appointments.append({
+            "doctor_id": doctor["_id"], "patient_id": patient["_id"],
+            "doctor_name": doctor["name"], "patient_name": patient["name"],
+            "date": day.isoformat(), "time": slot.strftime("%H:%M:%S"),
+            "qnum": SLOT_TIMES.index(slot) % 9 + 1,
+            "reason": "checkup", "created_at": datetime.utcnow(), "status": status,
+            **({ACTIVE_FIELD: True} if status != "cancelled" else {}),
+        })
+
+    await raw_db.doctor.insert_many(doctors)
+    await raw_db.patient.insert_many(patients)
+    await raw_db.staff.insert_one(staff)
+    for i in range(0, len(appointments), 5000):
+        await raw_db.appointment.insert_many(appointments[i:i + 5000])
+    # the queue counters `python -m utils.counters --rebuild` would derive from this history
+    counters = {}
+    for a in appointments:
+        key = (a["doctor_id"], a["date"], appointment_session(a))
+        seq, last_time = counters.get(key, (0, ""))
+        counters[key] = (max(seq, a["qnum"]), max(last_time, a["time"]))
+    if counters:
+        await raw_db.appointment_counter.insert_many([
+            {"doctor_id": doctor_id, "date": day, "session": session, "seq": seq, "last_time": last_time}
+            for (doctor_id, day, session), (seq, last_time) in counters.items()
+        ])
+    return {"doctors": doctors, "patients": patients, "staff": staff}
+
+
+async def main(args) -> dict:
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    # every bench client shares one address: measure bcrypt, not the login throttle
+    for setting in ("LOGIN_IP_RATE_PER_MINUTE", "LOGIN_EMAIL_RATE_PER_MINUTE", "LOGIN_MAX_CONCURRENT"):
+        os.environ.setdefault(setting, "0")
+    # the archiver's first pass would run during seeding and move history mid-run
+    os.environ.setdefault("ARCHIVE_INTERVAL_SECONDS", "0")
+    os.environ["DB_NAME"] = args.db_name
+    if args.mongo:
+        os.environ["DB_URI"] = args.mongo
+
+    import httpx
+    import db as database
+    if not args.mongo:
+        _use_in_memory_backend(database)
+    else:
+        # start from nothing, whatever an earlier (crashed) run left behind
+        database.connect()
+        await database.client.drop_database(args.db_name)
+        database.close()
+    import main as app_module
+    from utils.utility import hash_password, create_access_token, access_token_claims
+
+    app = app_module.app
+    async with app.router.lifespan_context(app):
+        raw_db = database.db._database
+
+        print(f"seeding {args.doctors} doctors, {args.patients + args.requests} patients, "
+              f"{args.appointments} appointments ...")
+        seeded = await seed(raw_db, args, hash_password(args.password))
+        doctors, patients, staff = seeded["doctors"], seeded["patients"], seeded["staff"]
+        bookers = patients[args.patients:]
+
+        def auth(user, role):
+            return {"Authorization": f"Bearer {create_access_token(access_token_claims(user, role))}"}
+
+        staff_headers = auth(staff, "staff")
+        doctor_headers = [auth(d, "doctor") for d in doctors]
+        patient_headers = [auth(p, "patient") for p in patients[:args.patients]]
+        booker_headers = [auth(p, "patient") for p in bookers]
+        rng = random.Random(args.seed)
+
+        # count DB calls from here on
+        database.db._database = _CountingDatabase(raw_db)
+
+        transport = httpx.ASGITransport(app=app)
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            login = [("POST", "/patient/login/", {"json": {"email": rng.choice(patients)["email"], "password": args.password}})
+                     for _ in range(args.login_requests)]
+            results.append(await run_flow(client, "login", login, args.concurrency))
+
+            booking = [("POST", "/create/appointment/", {"json": {"doctor_id": str(rng.choice(doctors)["_id"]), "reason": "bench"},
+                                                         "headers": headers}) for headers in booker_headers]
+            results.append(await run_flow(client, "booking", booking, args.concurrency))
+
+            listing = []
+            for _ in range(args.requests):
+                headers = rng.choice([staff_headers, rng.choice(doctor_headers), rng.choice(patient_headers)])
+                listing.append(("GET", "/my_appointments/", {"headers": headers}))
+            results.append(await run_flow(client, "listing", listing, args.concurrency))
+
+            booked = await raw_db.appointment.find(
+                {"patient_id": {"$in": [p["_id"] for p in bookers]}, "status": "pending"}, {"patient_id": 1}
+            ).to_list(length=None)
+            headers_by_patient = {p["_id"]: h for p, h in zip(bookers, booker_headers)}
+            cancel = [("PUT", f"/cancel/appointment/{a['_id']}/", {"headers": headers_by_patient[a["patient_id"]]})
+                      for a in booked]
+            results.append(await run_flow(client, "cancel", cancel, args.concurrency))
+
+        database.db._database = raw_db
+        if args.mongo:
+            await database.client.drop_database(args.db_name)
+
+    return {"flows": results}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", help="mongod URI; defaults to the in-memory backend")
+    parser.add_argument("--db-name", default=BENCH_DB_PREFIX, help=f"dropped with --mongo; must start with {BENCH_DB_PREFIX}")
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--appointments", type=int, default=10000)
+    parser.add_argument("--history-days", type=int, default=60)
+    parser.add_argument("--requests", type=int, default=300, help="requests per booking/listing flow")
+    parser.add_argument("--login-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=str(ROOT / "bench" / "results"))
+    args = parser.parse_args()
+    if not args.db_name.startswith(BENCH_DB_PREFIX):
+        parser.error(f"--db-name must start with {BENCH_DB_PREFIX}: the bench drops that database")
+
+    report = asyncio.run(main(args))
+    report["meta"] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "backend": "mongod" if args.mongo else "in-memory",
+        "python": platform.python_version(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("mongo", "password")},
+    }
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_file = out_dir / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out_file.write_text(json.dumps(report, indent=2))
+    print(f"saved {out_file}")